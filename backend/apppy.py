@@ -3,12 +3,19 @@ from flask_cors import CORS
 from flask_caching import Cache
 from routes import register_routes
 from error_handlers import register_error_handlers
+from compression import register_compression
 from dotenv import load_dotenv
 import os
 import shutil
+import multiprocessing
 from config import Config
 
-if os.path.exists(Config.TEMPDIR):
+# Chart workers of the PyInstaller build start this executable again, hand them over
+# to multiprocessing before the app starts
+multiprocessing.freeze_support()
+
+# Spawned chart workers import this module again as __mp_main__, keep the app's files
+if __name__ != "__mp_main__" and os.path.exists(Config.TEMPDIR):
     shutil.rmtree(Config.TEMPDIR)
 
 os.makedirs(Config.TEMPDIR, exist_ok=True)
@@ -25,6 +32,7 @@ cache = Cache(app, config={"CACHE_TYPE": "SimpleCache", "CACHE_DEFAULT_TIMEOUT":
 # Register routes and error handlers
 register_routes(app, cache)
 register_error_handlers(app)
+register_compression(app)
 
 if __name__ == "__main__":
     if os.getenv("PRODUCTION") == "True":
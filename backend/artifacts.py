@@ -0,0 +1,129 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from config import Config
+
+
+class ArtifactStore:
+    """
+    Generated files kept in a directory up to a total size, the least recently used
+    evicted first. Files are copied into the store, so a later export written to the same
+    file name does not change a stored artifact.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Key -> (path, size), least recently used first
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    def get(self, key):
+        """Path of the artifact stored for the key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        """Whether a file is stored for the key, without counting a hit or a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and os.path.exists(entry[0])
+
+    def _path(self, key, name):
+        folder = os.path.join(self.directory, key)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, name)
+
+    def put(self, key, source_path, name=None):
+        """
+        Store a copy of a file for the key under its name, or the given name, and
+        return its path in the store.
+        """
+        path = self._path(key, name or os.path.basename(source_path))
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, path)
+        return self._add(key, path)
+
+    def put_bytes(self, key, body, name):
+        """Store bytes for the key as a file of the given name and return its path."""
+        path = self._path(key, name)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(body)
+        os.replace(temp_path, path)
+        return self._add(key, path)
+
+    def _add(self, key, path):
+        size = os.path.getsize(path)
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (path, size)
+            self.bytes += size
+            evicted = self._evict()
+        for old_path in evicted:
+            if old_path != path:
+                self._remove(old_path)
+        return path
+
+    def discard(self, key):
+        """Remove the artifact of a key."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+        if entry is not None:
+            self._remove(entry[0])
+
+    def _evict(self):
+        evicted = []
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            _, (path, size) = self._entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            evicted.append(path)
+        return evicted
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            # Still being downloaded on Windows, or the folder holds other files
+            pass
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / requests, 4) if requests else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+artifact_store = ArtifactStore(
+    os.path.join(Config.TEMPDIR, "Artifacts"), Config.ARTIFACT_STORE_MAX_BYTES
+)
+
+
+def get_artifact_store_stats():
+    return artifact_store.stats()
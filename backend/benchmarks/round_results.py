@@ -0,0 +1,63 @@
+"""
+Benchmark of the rounding of result frames: the vectorised round_numeric_frame against
+the element by element DataFrame.map(round_numeric_values) it replaced, on a frame with
+a million float cells by default.
+
+Run from the backend folder:
+    python benchmarks/round_results.py [--rows 125000] [--columns 8] [--repeat 3]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import round_numeric_frame, round_numeric_values
+
+
+def make_frame(rows, columns, seed=0):
+    """Result-like frame of IDs, dates and float columns spanning several magnitudes."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "ID": rng.integers(1, 500, rows),
+            "Time": pd.date_range("2000-01-01", periods=rows, freq="h").strftime(
+                "%Y-%m-%d"
+            ),
+        }
+    )
+    for i in range(columns):
+        df[f"value_{i}"] = rng.random(rows) * 10.0 ** rng.integers(-4, 4)
+    return df
+
+
+def best_time(func, repeat):
+    """Best wall time of func over repeat runs and its last result."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=125000)
+    parser.add_argument("--columns", type=int, default=8, help="Float columns")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows, args.columns)
+    print(f"{args.rows} x {df.shape[1]} frame, {args.rows * args.columns} float cells")
+
+    mapped, mapped_df = best_time(lambda: df.map(round_numeric_values), args.repeat)
+    vectorised, vectorised_df = best_time(lambda: round_numeric_frame(df), args.repeat)
+    print(f"DataFrame.map(round_numeric_values)  {mapped:.3f} s per pass")
+    print(f"round_numeric_frame                  {vectorised:.4f} s")
+    print(f"speedup                              {mapped / vectorised:.0f}x")
+    print(f"identical frames                     {mapped_df.equals(vectorised_df)}")
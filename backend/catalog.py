@@ -0,0 +1,184 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import pandas as pd
+from config import Config
+from db_pool import get_connection
+
+CATALOG_VERSION = 1
+CATALOG_SUFFIX = ".catalog.json"
+
+# Date/time columns checked in order of preference with their date type and default interval
+DATE_COLUMNS = [
+    ("Time", "Time", "daily"),
+    ("Date", "Date", "daily"),
+    ("Month", "Month", "monthly"),
+    ("Year", "Year", "yearly"),
+]
+
+_catalogs = {}
+_lock = threading.Lock()
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _sidecar_paths(path):
+    """Catalog locations in order of preference: next to the database, then TEMPDIR."""
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()
+    return [
+        f"{path}{CATALOG_SUFFIX}",
+        os.path.join(Config.TEMPDIR, "catalogs", f"{digest}{CATALOG_SUFFIX}"),
+    ]
+
+
+def _read_sidecar(path, signature):
+    """Read a stored catalog if it matches the current size and mtime of the database."""
+    for sidecar in _sidecar_paths(path):
+        try:
+            with open(sidecar, "r") as file:
+                catalog = json.load(file)
+        except (OSError, ValueError):
+            continue
+        if (
+            catalog.get("version") == CATALOG_VERSION
+            and (catalog.get("size"), catalog.get("mtime_ns")) == signature
+        ):
+            return catalog
+    return None
+
+
+def _write_sidecar(path, catalog):
+    """Persist the catalog, falling back to TEMPDIR if the database folder is read-only."""
+    for sidecar in _sidecar_paths(path):
+        try:
+            os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+            temp_path = f"{sidecar}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w") as file:
+                json.dump(catalog, file)
+            os.replace(temp_path, sidecar)
+            return sidecar
+        except OSError:
+            continue
+    return None
+
+
+def column_affinity(declared_type):
+    """Return the SQLite type affinity of a declared column type."""
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        return "INTEGER"
+    if any(text in declared_type for text in ["CHAR", "CLOB", "TEXT"]):
+        return "TEXT"
+    if "BLOB" in declared_type or not declared_type:
+        return "BLOB"
+    if any(real in declared_type for real in ["REAL", "FLOA", "DOUB"]):
+        return "REAL"
+    return "NUMERIC"
+
+
+def _build_table_entry(conn, real_table_name):
+    """Scan a table once for its columns, date range, IDs and row count."""
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info('{real_table_name}')")
+    table_info = cursor.fetchall()
+    columns = [row[1] for row in table_info]
+
+    entry = {
+        "columns": columns,
+        "column_types": {row[1]: (row[2] or "").upper() for row in table_info},
+        "date_column": None,
+        "date_type": None,
+        "interval": None,
+        "start_date": None,
+        "end_date": None,
+        "date_is_iso": False,
+        "id_column": None,
+        "ids": [],
+        "row_count": 0,
+    }
+
+    for date_col, dtype, inter in DATE_COLUMNS:
+        if date_col not in columns:
+            continue
+        if date_col in ["Time", "Date"]:
+            # Distinct dates are a small fraction of the rows for per-ID result tables
+            dates = pd.read_sql_query(
+                f"SELECT DISTINCT {date_col} FROM '{real_table_name}'", conn
+            )[date_col]
+            parsed = pd.to_datetime(dates, errors="coerce")
+            entry["start_date"] = parsed.min().strftime("%Y-%m-%d")
+            entry["end_date"] = parsed.max().strftime("%Y-%m-%d")
+            # SQLite date functions only understand ISO-8601 values
+            entry["date_is_iso"] = bool(
+                dates.dropna()
+                .astype(str)
+                .map(lambda value: re.match(r"^\d{4}-\d{2}-\d{2}", value) is not None)
+                .all()
+            )
+        else:
+            cursor.execute(
+                f"SELECT MIN({date_col}), MAX({date_col}) FROM '{real_table_name}'"
+            )
+            start_date, end_date = cursor.fetchone()
+            entry["start_date"] = int(start_date)
+            entry["end_date"] = int(end_date)
+        entry["date_column"] = date_col
+        entry["date_type"] = dtype
+        entry["interval"] = inter
+        break
+
+    # Get list of IDs if an ID column exists
+    id_column = next((col for col in columns if "ID" in col), None)
+    if id_column:
+        cursor.execute(f"SELECT DISTINCT {id_column} FROM '{real_table_name}'")
+        entry["id_column"] = id_column
+        entry["ids"] = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute(f"SELECT COUNT(*) FROM '{real_table_name}'")
+    entry["row_count"] = cursor.fetchone()[0]
+
+    return entry
+
+
+def get_table_catalog(db_path, real_table_name):
+    """
+    Return the catalog entry of a table, building it on first use.
+    Catalogs are stored per database and invalidated when its size or mtime changes.
+    """
+    path = os.path.realpath(db_path)
+    signature = _file_signature(path)
+
+    with _lock:
+        catalog = _catalogs.get(path)
+        if catalog is None or (catalog["size"], catalog["mtime_ns"]) != signature:
+            catalog = _read_sidecar(path, signature) or {
+                "version": CATALOG_VERSION,
+                "size": signature[0],
+                "mtime_ns": signature[1],
+                "tables": {},
+            }
+            _catalogs[path] = catalog
+        entry = catalog["tables"].get(real_table_name)
+    if entry is not None:
+        return entry
+
+    with get_connection(path) as conn:
+        entry = _build_table_entry(conn, real_table_name)
+
+    with _lock:
+        # Only store the entry if the database did not change while scanning it
+        if (catalog["size"], catalog["mtime_ns"]) == signature:
+            catalog["tables"][real_table_name] = entry
+            _write_sidecar(path, catalog)
+    return entry
+
+
+def clear_catalogs():
+    """Drop the in-memory catalogs; stored sidecars are revalidated on next use."""
+    with _lock:
+        _catalogs.clear()
@@ -0,0 +1,254 @@
+import io
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+from matplotlib import colormaps
+from matplotlib.figure import Figure
+from matplotlib.image import imread
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.ticker import LinearLocator
+from cycler import cycler
+from config import Config
+from jobs import report_progress
+
+# Matplotlib Axes methods of the graph types
+PLOT_METHODS = {"line": "plot", "bar": "bar", "scatter": "scatter"}
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def new_figure(figsize=(10, 6)):
+    """
+    Figure attached to its own Agg canvas. Unlike pyplot figures it is not registered
+    globally, so concurrent exports do not share state and it is freed once unused.
+    """
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def draw_chart(
+    fig,
+    df,
+    date_type,
+    ID,
+    multi_graph_type,
+    selected_ids,
+    primary_axis_columns,
+    secondary_axis_columns,
+):
+    """
+    Plot the selected columns of a time series DataFrame on a figure, columns with large
+    values on a secondary y-axis, with one series per selected ID or per column.
+    """
+    ax1 = fig.add_subplot()
+    ax2 = ax1.twinx()  # Create a secondary y-axis
+    # Setting color cycles
+    ax1.set_prop_cycle(cycler(color=colormaps["tab10"].colors))
+    # Check if ax2 will have plots
+    ax2_has_data = any(
+        column_graph["name"] in secondary_axis_columns
+        for column_graph in multi_graph_type
+    )
+    if ax2_has_data:
+        ax2.set_prop_cycle(cycler(color=colormaps["Set2"].colors))
+
+    # Split the rows by ID once instead of filtering them for every ID and column
+    groups = (
+        {key: group for key, group in df.groupby(ID, sort=False)}
+        if selected_ids
+        else {}
+    )
+
+    for i, column_graph in enumerate(multi_graph_type):
+        column = column_graph["name"]
+        if df[column].dtype == "object":
+            continue
+        plot_func = getattr(
+            ax1 if column in primary_axis_columns else ax2,
+            PLOT_METHODS[column_graph["type"]],
+        )
+
+        if selected_ids:
+            # Create separate plots for each ID-Column combination
+            for j, selected_id in enumerate(selected_ids):
+                filtered_data = groups.get(selected_id, df.iloc[:0])
+                plot_func(
+                    (
+                        filtered_data[date_type] + pd.DateOffset((i + j) * 2)
+                        if column_graph["type"] == "bar"
+                        else filtered_data[date_type]
+                    ),
+                    filtered_data[column],
+                    label=f"{column} - {ID}: {selected_id}",
+                    alpha=0.7,
+                )
+        else:
+            # Plot each column as a single series if selected_ids is empty
+            plot_func(
+                (
+                    df[date_type] + pd.DateOffset(i * 2)
+                    if column_graph["type"] == "bar"
+                    else df[date_type]
+                ),
+                df[column],
+                label=column,
+                alpha=0.7,
+            )
+
+    # Customize axes
+    ax1.set_xlabel(date_type)
+    ax1.set_ylabel("Values (Smaller Values)")
+    ax1.yaxis.set_major_locator(LinearLocator(numticks=8))
+    ax1.grid(visible=True, linestyle="--", alpha=0.6)
+
+    if ax2_has_data:
+        ax2.set_ylabel("Values (Larger Values)")
+        # Ensure same number of y-axis ticks on both axes
+        ax2.yaxis.set_major_locator(LinearLocator(numticks=8))
+        ax2.grid(visible=True, linestyle="--", alpha=0.6)
+
+    ax1.legend(loc="upper left")
+    if ax2_has_data:
+        ax2.legend(loc="upper right")
+
+    # Rotate x-axis labels (explicitly for ax1 and ax2 if shared x-axis is used)
+    for tick in ax1.get_xticklabels():
+        tick.set_rotation(45)
+
+    # Adjust layout to avoid label overlap
+    fig.tight_layout()
+    return fig
+
+
+def save_chart(
+    file_path,
+    file_format,
+    df,
+    date_type,
+    ID,
+    multi_graph_type,
+    selected_ids,
+    primary_axis_columns,
+    secondary_axis_columns,
+):
+    """Save the chart of draw_chart to an image or pdf file."""
+    fig = draw_chart(
+        new_figure(),
+        df,
+        date_type,
+        ID,
+        multi_graph_type,
+        selected_ids,
+        primary_axis_columns,
+        secondary_axis_columns,
+    )
+    fig.savefig(file_path, format=file_format)
+
+
+def render_report_page(page):
+    """Render the chart of one ID to PNG bytes, in a worker process of the chart pool."""
+    title, df, date_type, ID, multi_graph_type, primary, secondary, dpi = page
+    fig = draw_chart(
+        new_figure(), df, date_type, ID, multi_graph_type, [], primary, secondary
+    )
+    fig.suptitle(title)
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi)
+    return buffer.getvalue()
+
+
+def get_chart_pool():
+    """
+    Process pool shared by report exports, started on first use. Workers are spawned
+    rather than forked, since forking the threaded server can copy held locks.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=Config.CHART_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _reset_chart_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_pages(pages):
+    """
+    PNG bytes of the report pages, in order. Pages are rendered across the chart pool,
+    or in this process when there is a single page or the pool has stopped working.
+    """
+    if len(pages) <= 1 or Config.CHART_WORKERS == 0:
+        yield from map(render_report_page, pages)
+        return
+    pool = get_chart_pool()
+    rendered = 0
+    try:
+        for png in pool.map(render_report_page, pages):
+            yield png
+            rendered += 1
+    except BrokenProcessPool:
+        # A worker died, for example killed for memory, so render the rest here
+        _reset_chart_pool(pool)
+        yield from map(render_report_page, pages[rendered:])
+
+
+def save_report(
+    file_path,
+    df,
+    date_type,
+    ID,
+    multi_graph_type,
+    selected_ids,
+    primary_axis_columns,
+    secondary_axis_columns,
+):
+    """
+    Save a multi-page PDF report with the chart of each selected ID, all IDs if none are
+    selected, on its own page. Pages are rendered in parallel at Config.REPORT_DPI and
+    written to the PDF one at a time.
+    """
+    groups = {key: group for key, group in df.groupby(ID)}
+    ids = [selected_id for selected_id in selected_ids if selected_id in groups]
+    if not selected_ids:
+        ids = list(groups)
+    if not ids:
+        raise ValueError("No data found for the selected IDs.")
+
+    pages = [
+        (
+            f"{ID}: {selected_id}",
+            groups[selected_id],
+            date_type,
+            ID,
+            multi_graph_type,
+            primary_axis_columns,
+            secondary_axis_columns,
+            Config.REPORT_DPI,
+        )
+        for selected_id in ids
+    ]
+    with PdfPages(file_path) as pdf:
+        for i, png in enumerate(render_pages(pages)):
+            report_progress(0.3 + 0.6 * i / len(pages), "Rendering pages")
+            # Pages are opaque, the alpha channel is dropped
+            image = imread(io.BytesIO(png), format="png")[..., :3]
+            height, width = image.shape[:2]
+            fig = new_figure(
+                figsize=(width / Config.REPORT_DPI, height / Config.REPORT_DPI)
+            )
+            fig.figimage(image)
+            pdf.savefig(fig, dpi=Config.REPORT_DPI)
@@ -0,0 +1,242 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from config import Config
+from db_pool import get_connection
+from catalog import get_table_catalog, column_affinity
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # The columnar mirror is optional
+    pa = pq = None
+
+ROWID_COLUMN = "__rowid"
+MIRROR_VERSION = "1"
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="columnar")
+_pending = set()
+# (database path, table) -> database (size, mtime) of a failed build, not retried
+# until the database changes
+_failed = {}
+_lock = threading.Lock()
+# Mirror path -> (mirror mtime, metadata) so the Parquet footer is only read once
+_metadata = {}
+
+
+def is_enabled():
+    return pq is not None and Config.COLUMNAR_CACHE
+
+
+def _mirror_path(db_path, table):
+    digest = hashlib.sha1(db_path.encode("utf-8")).hexdigest()
+    safe_table = re.sub(r"[^\w-]", "_", table)
+    return os.path.join(Config.COLUMNAR_DIR, f"{digest}_{safe_table}.parquet")
+
+
+def _arrow_type(declared_type, has_text=False):
+    """
+    Map a declared SQLite column type to an Arrow type using SQLite affinity rules.
+    Columns storing text, like dates declared DATE or DATETIME, are mirrored as strings.
+    """
+    affinity = column_affinity(declared_type)
+    if affinity == "TEXT" or has_text:
+        return pa.string()
+    if affinity == "INTEGER":
+        return pa.int64()
+    return pa.float64()
+
+
+def _text_columns(conn, table, columns):
+    """Columns without TEXT affinity that store text values, found in a single scan."""
+    if not columns:
+        return set()
+    checks = ", ".join(f"MAX(typeof(\"{col}\") = 'text')" for col in columns)
+    row = conn.execute(f"SELECT {checks} FROM '{table}'").fetchone()
+    return {col for col, has_text in zip(columns, row) if has_text}
+
+
+def build_mirror(db_path, table):
+    """Write the table to Parquet sorted by ID and date, tagged with the database size and mtime."""
+    db_path = os.path.realpath(db_path)
+    stat = os.stat(db_path)
+    entry = get_table_catalog(db_path, table)
+    sort_columns = [col for col in [entry["id_column"], entry["date_column"]] if col]
+
+    with get_connection(db_path) as conn:
+        text_columns = _text_columns(
+            conn,
+            table,
+            [
+                col
+                for col in entry["columns"]
+                if column_affinity(entry["column_types"].get(col, "")) != "TEXT"
+            ],
+        )
+    schema = pa.schema(
+        [
+            (
+                col,
+                _arrow_type(entry["column_types"].get(col, ""), col in text_columns),
+            )
+            for col in entry["columns"]
+        ]
+        + [(ROWID_COLUMN, pa.int64())]
+    ).with_metadata(
+        {
+            "version": MIRROR_VERSION,
+            "db_size": str(stat.st_size),
+            "db_mtime_ns": str(stat.st_mtime_ns),
+            "id_column": entry["id_column"] or "",
+            "date_column": entry["date_column"] or "",
+        }
+    )
+
+    mirror_path = _mirror_path(db_path, table)
+    temp_path = f"{mirror_path}.{threading.get_ident()}.tmp"
+    os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+
+    columns = ", ".join(f'"{col}"' for col in entry["columns"])
+    query = f"SELECT {columns}, rowid AS {ROWID_COLUMN} FROM '{table}'"
+    if sort_columns:
+        # Sorted row groups let ID and date filters skip most of the file
+        query += " ORDER BY " + ", ".join(f'"{col}"' for col in sort_columns)
+
+    try:
+        with get_connection(db_path) as conn, pq.ParquetWriter(
+            temp_path, schema, compression="zstd"
+        ) as writer:
+            for chunk in pd.read_sql_query(
+                query, conn, chunksize=Config.COLUMNAR_ROW_GROUP_SIZE
+            ):
+                writer.write_table(
+                    pa.Table.from_pandas(chunk, schema=schema, preserve_index=False),
+                    row_group_size=Config.COLUMNAR_ROW_GROUP_SIZE,
+                )
+        os.replace(temp_path, mirror_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return mirror_path
+
+
+def schedule_mirror_build(db_path, table):
+    """
+    Build the mirror in the background, ignoring tables already queued and tables whose
+    build failed for the current version of the database.
+    """
+    key = (os.path.realpath(db_path), table)
+    stat = os.stat(key[0])
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if key in _pending or _failed.get(key) == signature:
+            return False
+        _pending.add(key)
+
+    def run():
+        try:
+            build_mirror(*key)
+            with _lock:
+                _failed.pop(key, None)
+        except Exception:
+            # The mirror is only an optimization, reads fall back to SQLite
+            logger.exception("Columnar mirror of %s in %s failed", table, key[0])
+            with _lock:
+                _failed[key] = signature
+        finally:
+            with _lock:
+                _pending.discard(key)
+
+    _executor.submit(run)
+    return True
+
+
+def _read_metadata(mirror_path):
+    mtime = os.stat(mirror_path).st_mtime_ns
+    with _lock:
+        cached = _metadata.get(mirror_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    metadata = {
+        key.decode(): value.decode()
+        for key, value in (pq.read_schema(mirror_path).metadata or {}).items()
+    }
+    with _lock:
+        _metadata[mirror_path] = (mtime, metadata)
+    return metadata
+
+
+def _filter_value(field_type, value):
+    """Convert a request value to the type of the Parquet column it is compared with."""
+    if pa.types.is_integer(field_type):
+        return int(value)
+    if pa.types.is_floating(field_type):
+        return float(value)
+    return str(value)
+
+
+def read_mirror(
+    db_path, table, columns, id_column, selected_ids, date_type, start_date, end_date
+):
+    """
+    Read the selected columns and rows from the columnar mirror of a table.
+    Returns None (and schedules a rebuild) when the mirror is missing or stale.
+    """
+    if not is_enabled():
+        return None
+
+    db_path = os.path.realpath(db_path)
+    mirror_path = _mirror_path(db_path, table)
+    stat = os.stat(db_path)
+
+    metadata = _read_metadata(mirror_path) if os.path.exists(mirror_path) else None
+    if (
+        metadata is None
+        or metadata.get("version") != MIRROR_VERSION
+        or metadata.get("db_size") != str(stat.st_size)
+        or metadata.get("db_mtime_ns") != str(stat.st_mtime_ns)
+    ):
+        # Only mirror tables large enough for the SQLite row conversion to matter
+        if get_table_catalog(db_path, table)["row_count"] >= Config.COLUMNAR_MIN_ROWS:
+            schedule_mirror_build(db_path, table)
+        return None
+
+    schema = pq.read_schema(mirror_path)
+    if columns is not None and any(col not in schema.names for col in columns):
+        return None
+
+    filters = []
+    if selected_ids != []:
+        if id_column not in schema.names:
+            return None
+        id_type = schema.field(id_column).type
+        filters.append(
+            (id_column, "in", [_filter_value(id_type, value) for value in selected_ids])
+        )
+    if start_date and end_date:
+        if date_type not in schema.names:
+            return None
+        date_field_type = schema.field(date_type).type
+        filters.append((date_type, ">=", _filter_value(date_field_type, start_date)))
+        filters.append((date_type, "<=", _filter_value(date_field_type, end_date)))
+
+    read_columns = [
+        col
+        for col in (columns if columns is not None else schema.names)
+        if col != ROWID_COLUMN
+    ]
+    table_data = pq.read_table(
+        mirror_path,
+        columns=read_columns + [ROWID_COLUMN],
+        filters=filters or None,
+    )
+
+    # Restore the row order of the SQLite table
+    df = table_data.to_pandas().sort_values(ROWID_COLUMN, kind="stable")
+    return df.drop(columns=[ROWID_COLUMN]).reset_index(drop=True)
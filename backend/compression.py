@@ -0,0 +1,140 @@
+import gzip
+from flask import Response, request
+from config import Config
+from artifacts import artifact_store
+
+try:
+    import zstandard
+except ImportError:  # zstd responses are optional
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:  # Brotli responses are optional
+        brotli = None
+
+# Supported encodings in order of preference and the suffix of their stored artifacts
+ENCODINGS = {"zstd": ".zst", "br": ".br", "gzip": ".gz"}
+COMPRESSIBLE_MIMETYPES = [
+    "application/json",
+    "application/geo+json",
+    "application/vnd.apache.arrow.stream",
+    "image/svg+xml",
+]
+
+
+def available_encodings():
+    return [
+        encoding
+        for encoding in ENCODINGS
+        if (encoding != "zstd" or zstandard is not None)
+        and (encoding != "br" or brotli is not None)
+    ]
+
+
+def negotiate_encoding():
+    """Best encoding accepted by the client, preferring zstd, then Brotli, then gzip."""
+    if not Config.COMPRESSION:
+        return None
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def compress(body, encoding):
+    """Compress bytes with an encoding at its level from Config.COMPRESSION_LEVELS."""
+    level = Config.COMPRESSION_LEVELS[encoding]
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level)
+
+
+def compress_response(response):
+    """
+    Compress JSON and Arrow responses above COMPRESSION_MIN_BYTES with the best encoding
+    the client accepts. Files and responses that are already encoded are left as is.
+    """
+    if (
+        not Config.COMPRESSION
+        or response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    body = response.get_data()
+    if len(body) < Config.COMPRESSION_MIN_BYTES:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding:
+        response.set_data(compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def register_compression(app):
+    app.after_request(compress_response)
+
+
+def _artifact_key(name, encoding=None):
+    return f"{name}.{encoding}" if encoding else name
+
+
+def _read_stored(name, encoding=None):
+    path = artifact_store.get(_artifact_key(name, encoding))
+    if path is None:
+        return None
+    try:
+        with open(path, "rb") as file:
+            return file.read()
+    except FileNotFoundError:
+        # Evicted since it was looked up
+        return None
+
+
+def read_artifact(name, encoding):
+    """
+    Return (body, encoding) of a JSON artifact kept in the artifact store, or None if it
+    was not stored or was evicted. A compressed variant missing for the encoding is stored
+    the first time it is asked for, so later requests send the stored bytes without
+    compressing them again.
+    """
+    if encoding:
+        compressed = _read_stored(name, encoding)
+        if compressed is not None:
+            return compressed, encoding
+    body = _read_stored(name)
+    if body is None:
+        return None
+    return _store_variant(name, body, encoding)
+
+
+def store_artifact(name, body, encoding):
+    """Store a JSON artifact in the artifact store and return (body, encoding) to send."""
+    artifact_store.put_bytes(_artifact_key(name), body, f"{name}.json")
+    return _store_variant(name, body, encoding)
+
+
+def _store_variant(name, body, encoding):
+    if not encoding or len(body) < Config.COMPRESSION_MIN_BYTES:
+        return body, None
+    compressed = compress(body, encoding)
+    artifact_store.put_bytes(
+        _artifact_key(name, encoding), compressed, f"{name}.json{ENCODINGS[encoding]}"
+    )
+    return compressed, encoding
+
+
+def encoded_response(body, encoding, mimetype="application/json"):
+    """Response with a body already encoded by read_artifact or store_artifact."""
+    response = Response(body, mimetype=mimetype)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
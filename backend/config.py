@@ -28,3 +28,31 @@ class Config:
     )
     LOOKUP = "Jenette_Creek_Watershed/Database/lookup.db3"
     TEMPDIR = os.path.join(user_data_dir("IMWEBs-Viewer", False), "TempFiles")
+    # Read-only SQLite connection pool settings
+    DB_POOL_MAX_IDLE = 8  # Idle connections kept per database
+    DB_POOL_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database memory mapped
+    DB_POOL_CACHE_SIZE = -32768  # Negative values are KiB (32 MiB page cache)
+    ID_TEMP_TABLE_MIN = 500  # Larger ID selections are filtered through a temp table
+    FETCH_WORKERS = min(8, os.cpu_count() or 1)  # Tables fetched concurrently
+    RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Query results shared by the data routes
+    # Result table indexes of the indexer command line: "shadow" keeps the .db3 files
+    # untouched, "inplace" indexes them. The server only builds shadow indexes.
+    INDEX_MODE = "shadow"
+    INDEX_MIN_ROWS = 10000  # Smaller tables are not indexed
+    # Parquet mirror of large result tables, kept across restarts unlike TEMPDIR
+    COLUMNAR_CACHE = True  # Only used when pyarrow is installed
+    COLUMNAR_DIR = os.path.join(user_data_dir("IMWEBs-Viewer", False), "ColumnarCache")
+    COLUMNAR_MIN_ROWS = 100000  # Smaller tables are read from SQLite directly
+    COLUMNAR_ROW_GROUP_SIZE = 65536
+    EXPORT_CHUNK_ROWS = 50000  # Rows per chunk of streamed csv/txt exports
+    CHART_WORKERS = None  # Processes rendering report pages, one per core if None
+    REPORT_DPI = 150  # Resolution of the pages of per-ID pdf reports
+    # Background export jobs
+    JOB_WORKERS = 2  # Exports running at the same time
+    JOB_MAX_QUEUED = 16  # Waiting jobs before new ones are refused
+    JOB_HISTORY = 100  # Finished jobs kept for polling and download
+    ARTIFACT_STORE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # Files of finished exports
+    # Compression of JSON and Arrow responses, negotiated with Accept-Encoding
+    COMPRESSION = True
+    COMPRESSION_MIN_BYTES = 1024  # Smaller responses are sent uncompressed
+    COMPRESSION_LEVELS = {"zstd": 3, "br": 5, "gzip": 6}
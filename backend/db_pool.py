@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from config import Config
+
+
+class ConnectionPool:
+    """
+    Pool of read-only SQLite connections keyed by the resolved database path.
+    Idle connections are reused until the database file changes on disk.
+    """
+
+    def __init__(
+        self,
+        max_idle=Config.DB_POOL_MAX_IDLE,
+        mmap_size=Config.DB_POOL_MMAP_SIZE,
+        cache_size=Config.DB_POOL_CACHE_SIZE,
+    ):
+        self.max_idle = max_idle
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        # Resolved path -> {"signature": (size, mtime), "idle": [connections]}
+        self._pools = {}
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def _open(self, path):
+        """Open a read-only, immutable connection with the configured pragmas."""
+        uri = f"{Path(path).as_uri()}?mode=ro&immutable=1"
+        # Connections move between worker threads, but only one thread uses a checked out connection
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        return conn
+
+    def _close_all(self, connections):
+        for conn in connections:
+            conn.close()
+        self.discarded += len(connections)
+
+    def checkout(self, db_path):
+        """Return (resolved path, signature, connection) for the database file."""
+        if not db_path:
+            raise ValueError("Invalid database path specified.")
+        path = os.path.realpath(db_path)
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            pool = self._pools.setdefault(path, {"signature": signature, "idle": []})
+            # The file was replaced, immutable connections on the old file are stale
+            if pool["signature"] != signature:
+                self._close_all(pool["idle"])
+                pool["idle"] = []
+                pool["signature"] = signature
+            if pool["idle"]:
+                self.hits += 1
+                return path, signature, pool["idle"].pop()
+            self.misses += 1
+
+        return path, signature, self._open(path)
+
+    def checkin(self, path, signature, conn):
+        """Return a connection to the idle list, or close it if it is no longer usable."""
+        with self._lock:
+            pool = self._pools.get(path)
+            if (
+                pool is not None
+                and pool["signature"] == signature
+                and len(pool["idle"]) < self.max_idle
+                and not conn.in_transaction
+            ):
+                pool["idle"].append(conn)
+                return
+            self.discarded += 1
+        conn.close()
+
+    @contextmanager
+    def connection(self, db_path):
+        """Check out a pooled connection for the duration of the block."""
+        path, signature, conn = self.checkout(db_path)
+        try:
+            yield conn
+        finally:
+            self.checkin(path, signature, conn)
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            for pool in self._pools.values():
+                self._close_all(pool["idle"])
+            self._pools.clear()
+
+    def stats(self):
+        """Return the pool hit/miss counters and idle connections per database."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "discarded": self.discarded,
+                "hit_rate": (
+                    round(self.hits / (self.hits + self.misses), 4)
+                    if self.hits + self.misses
+                    else 0
+                ),
+                "idle": {path: len(pool["idle"]) for path, pool in self._pools.items()},
+            }
+
+
+pool = ConnectionPool()
+
+
+@contextmanager
+def attach_database(conn, db_path, schema, immutable=True):
+    """Attach another database read-only to a connection under a schema name for the block."""
+    uri = f"{Path(os.path.realpath(db_path)).as_uri()}?mode=ro"
+    conn.execute(
+        f"ATTACH DATABASE ? AS {schema}",
+        (f"{uri}&immutable=1" if immutable else uri,),
+    )
+    try:
+        yield schema
+    finally:
+        conn.execute(f"DETACH DATABASE {schema}")
+
+
+def get_connection(db_path):
+    """Context manager yielding a pooled read-only connection for the database."""
+    return pool.connection(db_path)
+
+
+def get_pool_stats():
+    return pool.stats()
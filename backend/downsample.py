@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+
+def _segment_argmax(values, starts):
+    """Position of the first maximum of each contiguous segment starting at starts."""
+    maxima = np.maximum.reduceat(values, starts)
+    lengths = np.diff(np.append(starts, len(values)))
+    candidates = np.flatnonzero(values == np.repeat(maxima, lengths))
+    segments = np.searchsorted(starts, candidates, side="right") - 1
+    _, first = np.unique(segments, return_index=True)
+    return candidates[first]
+
+
+def lttb_positions(series, x, y, max_points):
+    """
+    Largest-Triangle-Three-Buckets over many series at once. series, x and y hold one
+    entry per point, with the points of a series contiguous and ordered by x. Returns
+    the positions of the points kept: every point of series with at most max_points
+    points, else the first and last point and one point per bucket in between.
+    """
+    n = len(series)
+    if n == 0:
+        return np.array([], dtype=int)
+    starts = np.flatnonzero(np.r_[True, series[1:] != series[:-1]])
+    lengths = np.diff(np.append(starts, n))
+    series_of = np.repeat(np.arange(len(starts)), lengths)
+    position = np.arange(n) - starts[series_of]
+    length = lengths[series_of]
+
+    keep = (length <= max_points) | (position == 0) | (position == length - 1)
+    inner = np.flatnonzero(~keep)
+    if len(inner) == 0:
+        return np.flatnonzero(keep)
+
+    # Bucket of each inner point, max_points - 2 buckets per long series
+    buckets = max_points - 2
+    bucket = (position[inner] - 1) * buckets // (length[inner] - 2)
+    long_series = series_of[inner]
+    # Points stay ordered by series and position within each bucket
+    order = np.argsort(bucket, kind="stable")
+    inner, bucket, long_series = inner[order], bucket[order], long_series[order]
+    bucket_starts = np.searchsorted(bucket, np.arange(buckets + 1))
+
+    # Average point of every bucket, the third corner of the triangles of the previous one
+    cell = long_series * buckets + bucket
+    shape = (len(starts), buckets)
+    counts = np.bincount(cell, minlength=shape[0] * buckets).reshape(shape)
+    sum_x = np.bincount(cell, x[inner], shape[0] * buckets).reshape(shape)
+    sum_y = np.bincount(cell, y[inner], shape[0] * buckets).reshape(shape)
+    last = starts + lengths - 1
+    with np.errstate(invalid="ignore"):
+        avg_x = np.column_stack([sum_x[:, 1:] / counts[:, 1:], x[last]])
+        avg_y = np.column_stack([sum_y[:, 1:] / counts[:, 1:], y[last]])
+
+    # The first corner is the point kept in the previous bucket, the first point at first
+    a_x = x[starts].astype(float)
+    a_y = y[starts].astype(float)
+    chosen = []
+    for i in range(buckets):
+        rows = inner[bucket_starts[i] : bucket_starts[i + 1]]
+        owner = long_series[bucket_starts[i] : bucket_starts[i + 1]]
+        c_x, c_y = avg_x[owner, i], avg_y[owner, i]
+        area = np.abs(
+            (a_x[owner] - c_x) * (y[rows] - a_y[owner])
+            - (a_x[owner] - x[rows]) * (c_y - a_y[owner])
+        )
+        segment_starts = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+        picked = rows[_segment_argmax(area, segment_starts)]
+        chosen.append(picked)
+        a_x[series_of[picked]] = x[picked]
+        a_y[series_of[picked]] = y[picked]
+
+    keep[np.concatenate(chosen)] = True
+    return np.flatnonzero(keep)
+
+
+def downsample(df, id_column, date_column, max_points):
+    """
+    Reduce the rows of a time series DataFrame for charts: every numeric column of every
+    ID is downsampled to max_points with LTTB, and the rows kept for any column of an ID
+    are returned, so each series keeps the points that shape its line.
+    Missing values count as 0 when choosing points and are returned unchanged.
+    """
+    max_points = max(int(max_points), 3)
+    ids = df[id_column] if id_column in df.columns else pd.Series(0, index=df.index)
+    value_columns = [
+        i
+        for i, (col, dtype) in enumerate(zip(df.columns, df.dtypes))
+        if col not in [id_column, date_column] and pd.api.types.is_numeric_dtype(dtype)
+    ]
+    if len(df) <= max_points or not value_columns:
+        return df
+
+    # Rows of each ID in their original order, the x axis is the row position within the ID
+    codes = pd.factorize(ids, use_na_sentinel=False)[0]
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    x = np.arange(len(df)).astype(float)
+
+    # One series per ID and column, with the columns stacked after each other
+    values = df.iloc[order, value_columns].to_numpy(dtype=float, na_value=np.nan)
+    positions = lttb_positions(
+        np.concatenate(
+            [codes + i * (codes.max() + 1) for i in range(len(value_columns))]
+        ),
+        np.tile(x, len(value_columns)),
+        np.nan_to_num(values.T.ravel()),
+        max_points,
+    )
+    rows = np.zeros(len(df), dtype=bool)
+    rows[order[positions % len(df)]] = True
+    return df.iloc[np.flatnonzero(rows)]
@@ -0,0 +1,253 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from db_pool import get_connection
+
+_lock = threading.Lock()
+# Resolved BMP.db3 path -> ((size, mtime), FieldWeights)
+_weights = {}
+
+
+def _lookup(matrix, rows, cols):
+    """Values of a CSR matrix at the (row, col) pairs, 0 where nothing is stored."""
+    matrix.sort_indices()
+    stored_rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    # Row-major positions of the stored values are sorted, so pairs are found by bisection
+    stored = stored_rows.astype(np.int64) * matrix.shape[1] + matrix.indices
+    wanted = rows.astype(np.int64) * matrix.shape[1] + cols
+    positions = np.minimum(np.searchsorted(stored, wanted), max(len(stored) - 1, 0))
+    found = (stored[positions] == wanted) if len(stored) else np.zeros(len(wanted), bool)
+    return np.where(found, matrix.data[positions] if len(stored) else 0.0, 0.0)
+
+
+def value_columns(df, id_column, date_type):
+    """Numeric columns of a frame other than its ID and date."""
+    return [
+        col
+        for col in df.select_dtypes(include=["number"]).columns
+        if col not in [id_column, date_type]
+    ]
+
+
+def _repeats_first_block(values, length):
+    """Whether an array is its first length values repeated, compared without hashing."""
+    n_blocks = len(values) // length
+    if isinstance(values, np.ndarray):
+        return bool((values.reshape(n_blocks, length) == values[:length]).all())
+    # Arrow backed strings are compared in Arrow against the repeated first block
+    repeated = values[:length].take(np.tile(np.arange(length), n_blocks))
+    return bool((values == repeated).all())
+
+
+def date_grid(df, id_column, date_type):
+    """
+    IDs and dates of a frame of ID blocks that all hold the same unique dates in the same
+    order, like a result table ordered by ID and date, as (block IDs, block dates).
+    None for other frames.
+    """
+    ids = df[id_column].to_numpy()
+    if not len(ids):
+        return None
+    starts = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+    n_blocks = len(starts) + 1
+    length = len(ids) // n_blocks
+    if length * n_blocks != len(ids) or not (np.diff(starts) == length).all():
+        return None
+    if len(starts) and starts[0] != length:
+        return None
+    block_ids = ids[::length]
+    dates = df[date_type]
+    first = dates.iloc[:length]
+    if not pd.Index(block_ids).is_unique or first.isna().any():
+        return None
+    if not first.is_unique:
+        return None
+    values = dates.to_numpy() if dates.dtype == object else dates.array
+    if not _repeats_first_block(values, length):
+        return None
+    return block_ids, first
+
+
+class FieldWeights:
+    """
+    Area fractions of the subareas within their fields from the Subarea table of BMP.db3,
+    as a sparse (field x subarea) matrix.
+    """
+
+    def __init__(self, subarea_df):
+        # Rows without a field or subarea are dropped by the groupby of the field sums
+        subarea_df = subarea_df.dropna(subset=["Subarea", "FieldId"])
+        self.field_ids, field_rows = np.unique(
+            subarea_df["FieldId"].to_numpy(), return_inverse=True
+        )
+        self.subarea_ids, subarea_cols = np.unique(
+            subarea_df["Subarea"].to_numpy(), return_inverse=True
+        )
+        shape = (len(self.field_ids), len(self.subarea_ids))
+
+        area = subarea_df["Area"].to_numpy(dtype=float)
+        total_area = np.bincount(
+            field_rows, weights=np.nan_to_num(area), minlength=shape[0]
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = area / total_area[field_rows]
+        # Subareas without an area fraction add nothing to the field sums
+        fraction = np.where(np.isnan(fraction), 0.0, fraction)
+
+        self.matrix = sparse.coo_matrix(
+            (fraction, (field_rows, subarea_cols)), shape=shape
+        ).tocsr()
+        # Which subareas belong to which field, to know the dates a field has data for
+        self.membership = sparse.coo_matrix(
+            (np.ones(len(field_rows)), (field_rows, subarea_cols)), shape=shape
+        ).tocsr()
+        self._subareas = pd.Index(self.subarea_ids)
+
+    def field_rows(self, field_ids):
+        """Rows of the selected fields in ascending field ID order, all fields if none."""
+        if not field_ids:
+            return np.arange(len(self.field_ids))
+        selected = pd.Series(list(field_ids))
+        if np.issubdtype(self.field_ids.dtype, np.number):
+            selected = pd.to_numeric(selected, errors="coerce")
+        return np.flatnonzero(np.isin(self.field_ids, selected.to_numpy()))
+
+    def subareas(self, field_ids):
+        """IDs of the subareas within the selected fields."""
+        members = self.membership[self.field_rows(field_ids)]
+        return self.subarea_ids[np.unique(members.indices)].tolist()
+
+    def field_values(self, df, id_column, date_type, field_ids):
+        """
+        Area-weighted field sums of the numeric columns of subarea rows, per field and date.
+        Frames where every subarea has the same dates are weighted as (subarea x date)
+        arrays, others with a single sparse matrix multiply over all columns and dates.
+        """
+        columns = value_columns(df, id_column, date_type)
+        grid = date_grid(df, id_column, date_type) if date_type else None
+        if grid is not None:
+            return self._grid_field_values(
+                df, id_column, date_type, field_ids, columns, grid
+            )
+
+        subarea_cols = self._subareas.get_indexer(df[id_column])
+        if date_type:
+            date_codes, dates = pd.factorize(df[date_type], sort=True)
+        else:
+            date_codes, dates = np.zeros(len(df), dtype=int), pd.Index([0])
+        # Subareas missing from BMP.db3 and rows without a date have no field value
+        keep = (subarea_cols >= 0) & (date_codes >= 0)
+        subarea_cols = subarea_cols[keep]
+        date_codes = date_codes[keep]
+        values = np.nan_to_num(df.loc[keep, columns].to_numpy(dtype=float))
+
+        n_dates = len(dates)
+        rows = self.field_rows(field_ids)
+        present = self.membership[rows] @ sparse.csr_matrix(
+            (np.ones(len(date_codes)), (subarea_cols, date_codes)),
+            shape=(len(self.subarea_ids), n_dates),
+        )
+
+        # One block of dates per value column, so all columns share the multiply
+        stacked = sparse.csr_matrix(
+            (
+                values.T.ravel(),
+                (
+                    np.tile(subarea_cols, len(columns)),
+                    np.concatenate(
+                        [date_codes + i * n_dates for i in range(len(columns))]
+                    ),
+                ),
+            ),
+            shape=(len(self.subarea_ids), n_dates * len(columns)),
+        )
+        weighted = (self.matrix[rows] @ stacked).tocsr()
+
+        # Field and date of every field row, ordered by field then date like a groupby
+        present = present.tocsr()
+        present.sort_indices()
+        field_index = np.repeat(np.arange(len(rows)), np.diff(present.indptr))
+        date_index = present.indices
+
+        result = pd.DataFrame({id_column: self.field_ids[rows][field_index]})
+        if date_type:
+            result[date_type] = dates.take(date_index)
+        for i, col in enumerate(columns):
+            result[col] = _lookup(weighted, field_index, date_index + i * n_dates)
+        return result
+
+
+    def _grid_field_values(self, df, id_column, date_type, field_ids, columns, grid):
+        """
+        field_values of a frame where every subarea has the same dates: the values of each
+        column are viewed as a (subarea x date) array and weighted with one product,
+        without hashing the dates of every row.
+        """
+        block_ids, block_dates = grid
+        n_dates = len(block_dates)
+        # Only the dates of one subarea are sorted
+        date_order, dates = pd.factorize(block_dates, sort=True)
+        date_order = np.argsort(date_order)
+
+        subarea_cols = self._subareas.get_indexer(block_ids)
+        # Subareas missing from BMP.db3 have no field value
+        keep = subarea_cols >= 0
+        rows = self.field_rows(field_ids)
+        weights = self.matrix[rows][:, subarea_cols[keep]]
+        # Every subarea has every date, so fields with a subarea have data on all dates
+        has_data = np.diff(self.membership[rows][:, subarea_cols[keep]].indptr) > 0
+        weights = weights[has_data]
+        field_ids = self.field_ids[rows][has_data]
+
+        result = pd.DataFrame({id_column: np.repeat(field_ids, n_dates)})
+        result[date_type] = dates.take(np.tile(np.arange(n_dates), len(field_ids)))
+        # Reorder and copy the values only when needed, result tables are sorted by date
+        date_order = None if (np.diff(date_order) > 0).all() else date_order
+        keep = None if keep.all() else keep
+        for col in columns:
+            values = df[col].to_numpy(dtype=float).reshape(-1, n_dates)
+            if keep is not None:
+                values = values[keep]
+            if date_order is not None:
+                values = values[:, date_order]
+            if not np.isfinite(values).all():
+                values = np.nan_to_num(values)
+            result[col] = np.asarray(weights @ values).ravel()
+        return result
+
+
+def get_field_weights(bmp_db_path):
+    """Return the field weights of BMP.db3, rebuilt only when the file changes."""
+    path = os.path.realpath(bmp_db_path)
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+
+    with _lock:
+        cached = _weights.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with get_connection(path) as conn:
+        columns = [
+            col[1] for col in conn.execute("PRAGMA table_info('Subarea')").fetchall()
+        ]
+        # Get the ID column name for Subarea table
+        subarea_id = next((col for col in columns if "id" in col.lower()), "ID")
+        if (
+            subarea_id not in columns
+            or "FieldId" not in columns
+            or "Area" not in columns
+        ):
+            raise ValueError(
+                "Subarea table does not contain the required columns: ID, FieldId, Area"
+            )
+        subarea_df = pd.read_sql_query(
+            f'SELECT "{subarea_id}" AS Subarea, FieldId, Area FROM Subarea', conn
+        )
+
+    weights = FieldWeights(subarea_df)
+    with _lock:
+        _weights[path] = (signature, weights)
+    return weights
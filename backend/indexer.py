@@ -0,0 +1,272 @@
+import os
+import sys
+import sqlite3
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from db_pool import get_connection, attach_database
+from catalog import get_table_catalog
+
+SHADOW_SUFFIX = ".idx.sqlite"
+SHADOW_SCHEMA = "shadow_idx"
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="indexer")
+_pending = set()
+_lock = threading.Lock()
+# Resolved database path -> (signature, shadow path, {table: (id_column, date_column)})
+_shadow_state = {}
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _shadow_paths(path):
+    """Shadow index locations in order of preference: next to the database, then TEMPDIR."""
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()
+    return [
+        f"{path}{SHADOW_SUFFIX}",
+        os.path.join(Config.TEMPDIR, "indexes", f"{digest}{SHADOW_SUFFIX}"),
+    ]
+
+
+def _index_name(*parts):
+    return "ix_" + "_".join(part.replace(" ", "_") for part in parts)
+
+
+def find_result_tables(db_path):
+    """Return (table, id_column, date_column) for every table filtered by ID and date."""
+    with get_connection(db_path) as conn:
+        tables = [
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            ).fetchall()
+        ]
+
+    result_tables = []
+    for table in tables:
+        entry = get_table_catalog(db_path, table)
+        # Small tables are scanned faster than they are looked up through an index
+        if (
+            entry["id_column"]
+            and entry["date_column"]
+            and entry["row_count"] >= Config.INDEX_MIN_ROWS
+        ):
+            result_tables.append((table, entry["id_column"], entry["date_column"]))
+    return result_tables
+
+
+def build_inplace_indexes(db_path, result_tables):
+    """
+    Create composite (ID, date) and date indexes inside the database itself.
+    Pooled connections are immutable, so only run this while the database is not queried.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        for table, id_column, date_column in result_tables:
+            key_index = _index_name(table, id_column, date_column)
+            date_index = _index_name(table, date_column)
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "{key_index}" '
+                f'ON "{table}" ("{id_column}", "{date_column}")'
+            )
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "{date_index}" '
+                f'ON "{table}" ("{date_column}")'
+            )
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def build_shadow_index(db_path, result_tables):
+    """
+    Write the (ID, date, rowid) keys of each result table to a separate database with
+    covering indexes, leaving the source database untouched.
+    """
+    signature = _file_signature(db_path)
+    for shadow_path in _shadow_paths(db_path):
+        temp_path = f"{shadow_path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(shadow_path), exist_ok=True)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            conn = sqlite3.connect(temp_path, uri=True)
+        except (OSError, sqlite3.Error):
+            continue
+
+        try:
+            conn.execute(
+                "ATTACH DATABASE ? AS src",
+                (f"{Path(db_path).as_uri()}?mode=ro",),
+            )
+            conn.execute(
+                "CREATE TABLE shadow_meta (db_size INTEGER, db_mtime_ns INTEGER)"
+            )
+            conn.execute("INSERT INTO shadow_meta VALUES (?, ?)", signature)
+            conn.execute(
+                "CREATE TABLE shadow_tables (name TEXT, id_column TEXT, date_column TEXT)"
+            )
+            for table, id_column, date_column in result_tables:
+                column_types = get_table_catalog(db_path, table)["column_types"]
+                id_type = column_types.get(id_column, "")
+                date_type = column_types.get(date_column, "")
+                # Keep the declared types so comparisons use the same affinity as the source
+                conn.execute(
+                    f'CREATE TABLE "{table}" '
+                    f'("{id_column}" {id_type}, "{date_column}" {date_type}, rid INTEGER)'
+                )
+                conn.execute(
+                    f'INSERT INTO "{table}" '
+                    f'SELECT "{id_column}", "{date_column}", rowid FROM src."{table}"'
+                )
+                conn.execute(
+                    f'CREATE INDEX "{_index_name(table, id_column, date_column)}" '
+                    f'ON "{table}" ("{id_column}", "{date_column}", rid)'
+                )
+                conn.execute(
+                    f'CREATE INDEX "{_index_name(table, date_column)}" '
+                    f'ON "{table}" ("{date_column}", rid)'
+                )
+                conn.execute(
+                    "INSERT INTO shadow_tables VALUES (?, ?, ?)",
+                    (table, id_column, date_column),
+                )
+            conn.commit()
+            conn.execute("DETACH DATABASE src")
+            conn.execute("ANALYZE")
+            conn.commit()
+        except sqlite3.OperationalError:
+            # Folder is not writable (or the disk is full), try the next location
+            conn.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            continue
+        conn.close()
+
+        os.replace(temp_path, shadow_path)
+        with _lock:
+            _shadow_state.pop(db_path, None)
+        return shadow_path
+    return None
+
+
+def build_indexes(db_path, mode=None):
+    """Build the indexes of every result table in the database using the given mode."""
+    db_path = os.path.realpath(db_path)
+    mode = mode or Config.INDEX_MODE
+    result_tables = find_result_tables(db_path)
+    if not result_tables:
+        return {"tables": [], "mode": mode}
+
+    if mode == "inplace":
+        build_inplace_indexes(db_path, result_tables)
+        location = db_path
+    else:
+        location = build_shadow_index(db_path, result_tables)
+        if location is None:
+            return {"error": "No writable location found for the shadow index."}
+
+    return {
+        "tables": [table for table, _, _ in result_tables],
+        "mode": mode,
+        "location": location,
+    }
+
+
+def schedule_index_build(db_path):
+    """
+    Build shadow indexes in the background, ignoring databases already queued. In place
+    indexes are only built from the command line, since pooled immutable connections
+    may be reading the database while the server runs.
+    """
+    db_path = os.path.realpath(db_path)
+    with _lock:
+        if db_path in _pending:
+            return False
+        _pending.add(db_path)
+
+    def run():
+        try:
+            build_indexes(db_path, "shadow")
+        except Exception:
+            # An index is only an optimization, queries fall back to table scans
+            pass
+        finally:
+            with _lock:
+                _pending.discard(db_path)
+
+    _executor.submit(run)
+    return True
+
+
+def attach_shadow_index(conn, shadow_path, schema=SHADOW_SCHEMA):
+    """Attach a shadow index database read-only to a connection for the block."""
+    return attach_database(conn, shadow_path, schema, immutable=False)
+
+
+def _load_shadow_state(db_path, signature):
+    """Find a shadow index matching the current database signature."""
+    for shadow_path in _shadow_paths(db_path):
+        if not os.path.exists(shadow_path):
+            continue
+        try:
+            with get_connection(shadow_path) as conn:
+                if conn.execute("SELECT * FROM shadow_meta").fetchone() != signature:
+                    continue
+                tables = {
+                    name: (id_column, date_column)
+                    for name, id_column, date_column in conn.execute(
+                        "SELECT * FROM shadow_tables"
+                    ).fetchall()
+                }
+        except sqlite3.Error:
+            continue
+        return shadow_path, tables
+    return None, {}
+
+
+def get_shadow_index(db_path, table):
+    """Return (shadow path, id column, date column) if a fresh shadow index covers the table."""
+    db_path = os.path.realpath(db_path)
+    signature = _file_signature(db_path)
+    with _lock:
+        state = _shadow_state.get(db_path)
+    if state is None or state[0] != signature:
+        state = (signature, *_load_shadow_state(db_path, signature))
+        with _lock:
+            _shadow_state[db_path] = state
+
+    _, shadow_path, tables = state
+    if shadow_path is None or table not in tables:
+        return None
+    return (shadow_path, *tables[table])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build (ID, date) indexes for the result tables of IMWEBs databases."
+    )
+    parser.add_argument("databases", nargs="+", help="Paths to .db3 files")
+    parser.add_argument(
+        "--mode",
+        choices=["shadow", "inplace"],
+        default=Config.INDEX_MODE,
+        help="Write a shadow index database or index the source database in place",
+    )
+    args = parser.parse_args()
+
+    for database in args.databases:
+        result = build_indexes(database, args.mode)
+        if result.get("error"):
+            print(f"{database}: {result['error']}", file=sys.stderr)
+        else:
+            print(
+                f"{database}: indexed {len(result['tables'])} table(s) ({result['mode']})"
+            )
@@ -0,0 +1,171 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from artifacts import artifact_store
+
+# Job of the current worker thread, for report_progress
+_current = threading.local()
+
+
+class JobCancelled(Exception):
+    """Raised by report_progress in a job that was cancelled."""
+
+
+class Job:
+    """State of a background export job."""
+
+    def __init__(self, kind, owner):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.status = "queued"  # queued, running, done, failed or cancelled
+        self.progress = 0.0
+        self.message = None
+        self.error = None
+        self.file_name = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = threading.Event()
+        self.future = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "type": self.kind,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "error": self.error,
+            "file_name": self.file_name,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    """
+    Export jobs run on a bounded pool of worker threads, so heavy exports do not hold the
+    threads serving interactive requests. The files of finished jobs are kept in the
+    artifact store until they are downloaded or evicted.
+    """
+
+    def __init__(
+        self,
+        max_workers=Config.JOB_WORKERS,
+        max_queued=Config.JOB_MAX_QUEUED,
+        max_history=Config.JOB_HISTORY,
+    ):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="export-job"
+        )
+        self.max_queued = max_queued
+        self.max_history = max_history
+        self._lock = threading.Lock()
+        # Job id -> Job, oldest first
+        self._jobs = OrderedDict()
+
+    def submit(self, kind, owner, func, *args):
+        """
+        Queue func(*args), which returns {"file_path": ...} or {"error": ...}.
+        Returns the job, or None when too many jobs are waiting.
+        """
+        job = Job(kind, owner)
+        with self._lock:
+            queued = sum(1 for other in self._jobs.values() if other.status == "queued")
+            if queued >= self.max_queued:
+                return None
+            self._jobs[job.id] = job
+            self._forget_finished()
+            job.future = self._executor.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id, owner):
+        """The job of an owner, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.owner == owner else None
+
+    def cancel(self, job_id, owner):
+        """Cancel a queued job, or ask a running job to stop at its next progress report."""
+        job = self.get(job_id, owner)
+        if job is None:
+            return None
+        job.cancel_requested.set()
+        if job.future.cancel():
+            self._finish(job, "cancelled")
+        return job
+
+    def _run(self, job, func, args):
+        if job.cancel_requested.is_set():
+            self._finish(job, "cancelled")
+            return
+        job.status = "running"
+        job.started = time.time()
+        _current.job = job
+        try:
+            result = func(*args)
+            # Services turn exceptions into errors, so check the flag rather than the result
+            if job.cancel_requested.is_set():
+                self._finish(job, "cancelled")
+            elif result.get("error", None):
+                job.error = result["error"]
+                self._finish(job, "failed")
+            else:
+                # Storing the file can fail too, for example on a full disk
+                artifact_store.put(job.id, result["file_path"])
+                job.file_name = os.path.basename(result["file_path"])
+                job.progress = 1.0
+                self._finish(job, "done")
+        except JobCancelled:
+            self._finish(job, "cancelled")
+        except Exception as e:
+            if job.cancel_requested.is_set():
+                self._finish(job, "cancelled")
+            else:
+                job.error = str(e)
+                self._finish(job, "failed")
+        finally:
+            _current.job = None
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+
+    def _forget_finished(self):
+        # Drop the oldest finished jobs, with their files, beyond max_history jobs
+        finished = [
+            job
+            for job in self._jobs.values()
+            if job.status in ["done", "failed", "cancelled"]
+        ]
+        for job in finished[: max(len(self._jobs) - self.max_history, 0)]:
+            del self._jobs[job.id]
+            artifact_store.discard(job.id)
+
+    def file_path(self, job):
+        """Path of the file of a finished job, None once it was evicted."""
+        return artifact_store.get(job.id) if job.status == "done" else None
+
+
+job_queue = JobQueue()
+
+
+def report_progress(fraction, message=None):
+    """
+    Report the progress (0 to 1) of the job running in this thread, if any, and stop it
+    with JobCancelled if it was cancelled.
+    """
+    job = getattr(_current, "job", None)
+    if job is None:
+        return
+    if job.cancel_requested.is_set():
+        raise JobCancelled()
+    job.progress = max(job.progress, min(fraction, 1.0))
+    if message is not None:
+        job.message = message
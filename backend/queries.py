@@ -0,0 +1,423 @@
+import os
+import sqlite3
+from contextlib import ExitStack, contextmanager
+import pandas as pd
+from config import Config
+from db_pool import get_connection, attach_database
+from indexer import get_shadow_index, attach_shadow_index
+from catalog import get_table_catalog, column_affinity
+
+# SQLite allows 10 attached databases by default
+MAX_ATTACHED = 10
+
+# Seasons of the months, matching get_season_from_date
+SEASON_CASE = (
+    "CASE WHEN {month} IN (12, 1, 2) THEN 'Winter' "
+    "WHEN {month} IN (3, 4, 5) THEN 'Spring' "
+    "WHEN {month} IN (6, 7, 8) THEN 'Summer' ELSE 'Autumn' END"
+)
+SEASON_NAMES = {
+    "winter": "Winter",
+    "spring": "Spring",
+    "summer": "Summer",
+    "fall": "Autumn",
+}
+
+
+class JoinNotSupported(Exception):
+    """Raised for table selections the joined query can not express."""
+
+
+def quote(name):
+    """Quote an SQL identifier."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+@contextmanager
+def id_list(conn, selected_ids, name="selected_ids"):
+    """
+    Yield the (SQL, parameters) operand of an IN filter for the selected IDs, or None
+    when nothing is selected. Large selections are loaded into a temporary table of the
+    connection instead of binding one parameter per ID, and dropped after the block.
+    """
+    if not selected_ids:
+        yield None
+        return
+    if len(selected_ids) < Config.ID_TEMP_TABLE_MIN:
+        yield ",".join(["?"] * len(selected_ids)), list(selected_ids)
+        return
+
+    table = f"temp.{quote(name)}"
+    # An untyped column takes the affinity of the compared column, like bound parameters
+    conn.execute(f"CREATE TEMP TABLE {quote(name)} (value PRIMARY KEY)")
+    try:
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {table} VALUES (?)",
+            ((value,) for value in selected_ids),
+        )
+        # Pooled connections must not be returned inside a transaction
+        conn.commit()
+        yield f"SELECT value FROM {table}", []
+    finally:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def build_filter(
+    table,
+    id_column,
+    ids,
+    date_type,
+    start_date,
+    end_date,
+    schema="main",
+    shadow=None,
+):
+    """
+    Build the WHERE clause and parameters for the ID and date range filters of a table.
+    ids is the operand yielded by id_list. When a shadow index with the same key columns
+    is given, the rows are looked up by rowid.
+    """
+    conditions = []
+    params = []
+
+    # Add conditions for selected_ids
+    if ids is not None:
+        conditions.append(f"{quote(id_column)} IN ({ids[0]})")
+        params.extend(ids[1])
+
+    # Add date range conditions
+    if start_date and end_date:
+        conditions.append(f"{quote(date_type)} BETWEEN ? AND ?")
+        params.extend([start_date, end_date])
+
+    if not conditions:
+        return "", params
+
+    if (
+        shadow is not None
+        and shadow[1] == id_column
+        and (not (start_date and end_date) or shadow[2] == date_type)
+    ):
+        return (
+            f" WHERE {schema}.{quote(table)}.rowid IN "
+            f"(SELECT rid FROM {shadow[0]}.{quote(table)} WHERE {' AND '.join(conditions)})",
+            params,
+        )
+    return f" WHERE {' AND '.join(conditions)}", params
+
+
+def supports_aggregation(db_path, table, columns, id_column, date_type):
+    """
+    Check that SQLite can aggregate the selected columns of a table by ID and period:
+    the dates must be ISO-8601 and every value column an integer, real or text column.
+    """
+    entry = get_table_catalog(db_path, table)
+    columns = columns if columns is not None else entry["columns"]
+    if (
+        entry["date_column"] != date_type
+        or not entry["date_is_iso"]
+        or id_column not in columns
+        or date_type not in columns
+    ):
+        return False
+    for col in columns:
+        if col in [id_column, date_type]:
+            continue
+        # Another ID column would be the grouping key of aggregate_data
+        if "ID" in col:
+            return False
+        if column_affinity(entry["column_types"].get(col, "")) not in [
+            "INTEGER",
+            "REAL",
+            "TEXT",
+        ]:
+            return False
+    return True
+
+
+def aggregate_query(query, id_column, date_type, value_columns, aggregation):
+    """
+    Wrap a row query in a GROUP BY summing the numeric columns per ID and interval period,
+    with the same period labels, month/season filters and row order as aggregate_data.
+    value_columns holds (column, affinity) pairs; text columns are left out like
+    sum(numeric_only=True) does.
+    """
+    interval = aggregation["interval"]
+    date = quote(date_type)
+    month = f"CAST(strftime('%m', {date}) AS INTEGER)"
+    season = SEASON_CASE.format(month=month)
+
+    if interval == "monthly":
+        period = f"strftime('%Y-%m', {date})"
+    elif interval == "yearly":
+        period = f"strftime('%Y', {date})"
+    else:
+        # Quarters starting in December labelled by their first month, like freq="QS-DEC"
+        period = (
+            f"CASE WHEN {month} <= 2 THEN printf('%04d-12', strftime('%Y', {date}) - 1) "
+            f"WHEN {month} = 12 THEN strftime('%Y-12', {date}) "
+            f"ELSE strftime('%Y-', {date}) || printf('%02d', {month} - {month} % 3) END"
+        )
+
+    keys = [quote(id_column)]
+    select = [f"{quote(id_column)} AS {quote(id_column)}"]
+    if interval == "seasonally":
+        keys.append(season)
+        select.append(f'{season} AS "Season"')
+    keys.append(period)
+    select.append(f"{period} AS {date}")
+
+    for name, affinity in value_columns:
+        col = quote(name)
+        if affinity not in ["INTEGER", "REAL"]:
+            continue
+        # Groups without values sum to 0 in pandas
+        select.append(f"COALESCE(SUM({col}), 0) AS {col}")
+
+    # Rows without an ID or a valid date are dropped by groupby
+    conditions = [f"{quote(id_column)} IS NOT NULL", f"{period} IS NOT NULL"]
+    params = []
+    if interval == "monthly" and aggregation.get("month"):
+        conditions.append(f"{month} = ?")
+        params.append(int(aggregation["month"]))
+    if interval == "seasonally" and aggregation.get("season"):
+        conditions.append(f"{season} = ?")
+        params.append(SEASON_NAMES.get(aggregation["season"]))
+
+    order = ", ".join(str(i + 1) for i in range(len(keys)))
+    return (
+        f"SELECT {', '.join(select)} FROM ({query}) "
+        f"WHERE {' AND '.join(conditions)} "
+        f"GROUP BY {', '.join(keys)} ORDER BY {order}",
+        params,
+    )
+
+
+def filtered_query(
+    conn,
+    stack,
+    db_path,
+    table,
+    columns,
+    id_column,
+    selected_ids,
+    date_type,
+    start_date,
+    end_date,
+):
+    """
+    Build the query of the selected columns of a table filtered by IDs and date range on
+    an open connection. The temporary ID table and shadow index it needs are released when
+    the stack is closed.
+    """
+    # Use the shadow (ID, date) index of the table if one was built for this file
+    shadow = get_shadow_index(db_path, table)
+
+    select = ",".join(quote(col) for col in columns) if columns is not None else "*"
+    query = f"SELECT {select} FROM main.{quote(table)}"
+
+    if shadow is not None:
+        schema = stack.enter_context(attach_shadow_index(conn, shadow[0]))
+        shadow = (schema, *shadow[1:])
+    ids = stack.enter_context(id_list(conn, selected_ids))
+    where, params = build_filter(
+        table,
+        id_column,
+        ids,
+        date_type,
+        start_date,
+        end_date,
+        shadow=shadow,
+    )
+    return query + where, params
+
+
+def query_table(
+    db_path,
+    table,
+    columns,
+    id_column,
+    selected_ids,
+    date_type,
+    start_date,
+    end_date,
+    aggregation=None,
+):
+    """
+    Query the selected columns of a table filtered by IDs and date range.
+    With an aggregation, the rows are summed per ID and interval period in SQLite.
+    """
+    with get_connection(db_path) as conn, ExitStack() as stack:
+        query, params = filtered_query(
+            conn,
+            stack,
+            db_path,
+            table,
+            columns,
+            id_column,
+            selected_ids,
+            date_type,
+            start_date,
+            end_date,
+        )
+
+        if aggregation:
+            column_types = get_table_catalog(db_path, table)["column_types"]
+            value_columns = [
+                (col, column_affinity(column_types.get(col, "")))
+                for col in (columns if columns is not None else column_types)
+                if col not in [id_column, date_type]
+            ]
+            query, aggregate_params = aggregate_query(
+                query, id_column, date_type, value_columns, aggregation
+            )
+            params += aggregate_params
+
+        return pd.read_sql_query(query, conn, params=params)
+
+
+def iter_table(
+    db_path,
+    table,
+    columns,
+    id_column,
+    selected_ids,
+    date_type,
+    start_date,
+    end_date,
+    chunk_size,
+    dtype=None,
+):
+    """
+    Yield the rows of query_table in DataFrames of up to chunk_size rows read from the
+    cursor, holding the connection until the generator is exhausted or closed.
+    """
+    with get_connection(db_path) as conn, ExitStack() as stack:
+        query, params = filtered_query(
+            conn,
+            stack,
+            db_path,
+            table,
+            columns,
+            id_column,
+            selected_ids,
+            date_type,
+            start_date,
+            end_date,
+        )
+        yield from pd.read_sql_query(
+            query, conn, params=params, chunksize=chunk_size, dtype=dtype
+        )
+
+
+def query_joined_tables(
+    tables,
+    id_column,
+    date_type,
+    selected_ids,
+    start_date,
+    end_date,
+    aggregation=None,
+):
+    """
+    Outer join tables sharing the (ID, date) key in a single query by attaching their
+    databases to one connection. Each entry of tables holds the database path, the real
+    table name and (real column, output column) pairs, with the key columns included.
+    With an aggregation, the joined rows are summed per ID and interval period.
+    Raises JoinNotSupported when the tables need more attached databases than SQLite
+    allows or SQLite rejects the query.
+    """
+    main_path = os.path.realpath(tables[0]["db_path"])
+    db_paths = {os.path.realpath(table["db_path"]) for table in tables}
+    shadows = [get_shadow_index(table["db_path"], table["table"]) for table in tables]
+    if len(db_paths) - 1 + sum(shadow is not None for shadow in shadows) > MAX_ATTACHED:
+        raise JoinNotSupported("Too many databases to attach")
+
+    with get_connection(main_path) as conn, ExitStack() as stack:
+        schemas = {main_path: "main"}
+        for path in sorted(db_paths - {main_path}):
+            schemas[path] = stack.enter_context(
+                attach_database(conn, path, f"db{len(schemas)}")
+            )
+
+        # The ID selection is shared by the filters of all tables
+        ids = stack.enter_context(id_list(conn, selected_ids))
+        ctes = []
+        params = []
+        for i, (table, shadow) in enumerate(zip(tables, shadows)):
+            schema = schemas[os.path.realpath(table["db_path"])]
+            if shadow is not None:
+                shadow_schema = stack.enter_context(
+                    attach_shadow_index(conn, shadow[0], f"shadow_idx{i}")
+                )
+                shadow = (shadow_schema, *shadow[1:])
+            where, table_params = build_filter(
+                table["table"],
+                id_column,
+                ids,
+                date_type,
+                start_date,
+                end_date,
+                schema,
+                shadow,
+            )
+            select = ", ".join(
+                f"{quote(real)} AS {quote(name)}" for real, name in table["columns"]
+            )
+            ctes.append(
+                f"t{i} AS (SELECT {select} FROM {schema}.{quote(table['table'])}{where})"
+            )
+            params.extend(table_params)
+
+        # Union of the keys of all tables, like pd.merge(how="outer")
+        ctes.append(
+            "keys AS ("
+            + " UNION ".join(
+                f"SELECT {quote(id_column)} AS k_id, {quote(date_type)} AS k_date FROM t{i}"
+                for i in range(len(tables))
+            )
+            + ")"
+        )
+
+        # Columns of the first table keep their position, later tables add their values
+        select = []
+        value_columns = []
+        for i, table in enumerate(tables):
+            column_types = get_table_catalog(table["db_path"], table["table"])[
+                "column_types"
+            ]
+            for real, name in table["columns"]:
+                if name == id_column:
+                    if i == 0:
+                        select.append(f"keys.k_id AS {quote(id_column)}")
+                elif name == date_type:
+                    if i == 0:
+                        select.append(f"keys.k_date AS {quote(date_type)}")
+                else:
+                    select.append(f"t{i}.{quote(name)}")
+                    value_columns.append(
+                        (name, column_affinity(column_types.get(real, "")))
+                    )
+
+        joins = " ".join(
+            f"LEFT JOIN t{i} ON t{i}.{quote(id_column)} IS keys.k_id "
+            f"AND t{i}.{quote(date_type)} IS keys.k_date"
+            for i in range(len(tables))
+        )
+        query = (
+            f"WITH {', '.join(ctes)} SELECT {', '.join(select)} FROM keys {joins} "
+            "ORDER BY keys.k_id, keys.k_date"
+        )
+
+        if aggregation:
+            query, aggregate_params = aggregate_query(
+                query, id_column, date_type, value_columns, aggregation
+            )
+            params += aggregate_params
+
+        try:
+            return pd.read_sql_query(query, conn, params=params)
+        except sqlite3.OperationalError as e:
+            # SQLite limits, such as the terms of a compound SELECT or the columns of a
+            # result, depend on the selection
+            raise JoinNotSupported(str(e)) from e
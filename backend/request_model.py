@@ -0,0 +1,120 @@
+import json
+from dataclasses import dataclass, field, fields
+from result_cache import make_key, frame_size
+
+
+def _load(value, default=None):
+    """Parse a JSON encoded request value; values sent as JSON bodies are already parsed."""
+    if value is None or value == "":
+        return default
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _optional(value):
+    """Treat empty strings like missing parameters."""
+    return value if value not in ["", None] else None
+
+
+def _id_sort_key(value):
+    value = str(value)
+    return (0, int(value), value) if value.lstrip("-").isdigit() else (1, 0, value)
+
+
+@dataclass(frozen=True)
+class DataRequest:
+    """
+    Typed form of the /api/get_data parameters with defaults filled in.
+    IDs, methods and statistics are deduplicated and sorted since their order does not
+    change the result. Tables keep their order: the first table that has a column
+    supplies it. Columns keep the request order for the output, but are sorted in the
+    cache key since they are reordered after the query.
+    """
+
+    db_tables: tuple
+    columns: object  # "All" or a tuple of column names
+    ids: tuple
+    id_column: str = "ID"
+    start_date: str = None
+    end_date: str = None
+    date_type: str = None
+    interval: str = "daily"
+    method: tuple = ("Equal",)
+    statistics: tuple = ("None",)
+    month: str = None
+    season: str = None
+    spatial_scale: str = None
+    math_formula: str = None
+
+    # Request argument names of the fields that are not named after them
+    ARGUMENTS = {"ids": "id"}
+
+    @classmethod
+    def from_args(cls, args):
+        """Parse request arguments (query string or JSON body) into a DataRequest."""
+        columns = args.get("columns")
+        columns = "All" if columns == "All" else _load(columns, [])
+        if columns != "All":
+            # Repeated columns are only returned once
+            columns = tuple(dict.fromkeys(columns))
+
+        return cls(
+            db_tables=tuple(
+                (table["db"], table["table"]) for table in _load(args.get("db_tables"))
+            ),
+            columns=columns,
+            ids=tuple(
+                sorted(
+                    {str(value) for value in _load(args.get("id"), [])},
+                    key=_id_sort_key,
+                )
+            ),
+            id_column=args.get("id_column", "ID"),
+            start_date=_optional(args.get("start_date")),
+            end_date=_optional(args.get("end_date")),
+            date_type=args.get("date_type"),
+            interval=_optional(args.get("interval")) or "daily",
+            method=tuple(sorted(set(_load(args.get("method"), ["Equal"])))),
+            statistics=tuple(sorted(set(_load(args.get("statistics"), ["None"])))),
+            month=_optional(args.get("month")),
+            season=_optional(args.get("season")),
+            spatial_scale=_optional(args.get("spatial_scale")),
+            math_formula=_optional(args.get("math_formula")),
+        )
+
+    @classmethod
+    def argument_names(cls):
+        """Request argument names read by from_args."""
+        return [cls.ARGUMENTS.get(field.name, field.name) for field in fields(cls)]
+
+    def canonical(self):
+        """Return the parameters that determine the result, in canonical form."""
+        params = {field.name: getattr(self, field.name) for field in fields(self)}
+        if self.columns != "All":
+            params["columns"] = sorted(self.columns)
+        return params
+
+    def cache_key(self, file_paths=(), **extra):
+        """
+        Stable hash of the canonical parameters, any extra values and the size and
+        mtime of the files the request reads.
+        """
+        return make_key({**self.canonical(), **extra}, file_paths)
+
+
+@dataclass(frozen=True, eq=False)
+class DataResult:
+    """
+    Result of a data request as DataFrames, shared through the result cache. Services
+    read the frames directly; only the JSON adapter of /api/get_data turns them into
+    records. The frames are shared and must not be modified in place.
+    """
+
+    df: object  # pandas.DataFrame of the data
+    stats_df: object = None  # pandas.DataFrame of the statistics, if requested
+    new_feature: str = None  # Column added by the math formula
+    timings: list = field(default_factory=list)
+    cached: bool = False
+
+    def size(self):
+        """Approximate memory used by the frames, for the result cache budget."""
+        return frame_size(self.df, self.stats_df)
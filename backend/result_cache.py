@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from config import Config
+
+
+class ResultCache:
+    """
+    Least recently used cache of query results bounded by their size in bytes.
+    Values are shared between callers and must not be modified in place.
+    """
+
+    def __init__(self, max_bytes=Config.RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Key -> (value, size in bytes), oldest first
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value for the key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        """Whether a value is cached for the key, without counting a hit or a miss."""
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, value, size):
+        """Store a value, evicting the least recently used entries to stay within budget."""
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            while self._entries and self.bytes + size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self.bytes += size
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Return the hit/miss/eviction counters and the memory used by the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (
+                    round(self.hits / (self.hits + self.misses), 4)
+                    if self.hits + self.misses
+                    else 0
+                ),
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+result_cache = ResultCache()
+
+
+def make_key(params, file_paths):
+    """
+    Hash request parameters together with the size and mtime of the files they read,
+    so results are invalidated when a database is replaced.
+    """
+    files = []
+    for path in sorted(set(file_paths)):
+        try:
+            stat = os.stat(path)
+            files.append([path, stat.st_size, stat.st_mtime_ns])
+        except OSError:
+            files.append([path, None, None])
+    payload = json.dumps(
+        {"params": params, "files": files}, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def frame_size(*frames):
+    """Approximate memory used by DataFrames, including the strings of object columns."""
+    return int(
+        sum(
+            frame.memory_usage(index=True, deep=True).sum()
+            for frame in frames
+            if frame is not None
+        )
+    )
+
+
+def get_result_cache_stats():
+    return result_cache.stats()
+
+
+def clear_result_cache():
+    result_cache.clear()
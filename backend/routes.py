@@ -1,4 +1,5 @@
-from flask import jsonify, request, send_file
+from flask import Response, jsonify, request, send_file
+import io
 import mimetypes
 from werkzeug.utils import safe_join
 import os
@@ -8,23 +9,43 @@ from flask_jwt_extended import (
     create_access_token,
     jwt_required,
     get_jwt,
+    get_jwt_identity,
     verify_jwt_in_request,
 )
 from dotenv import load_dotenv
 import secrets
+import hashlib
 import bcrypt
 from config import Config
+from request_model import DataRequest
 from services import (
+    data_cache_key,
     fetch_data_service,
+    fetch_data_arrow_service,
     get_files_and_folders,
     get_table_names,
     export_data_service,
+    stream_export_service,
     get_multi_columns_and_time_range,
     process_geospatial_data,
+    geospatial_artifact_name,
     export_map_service,
     fetch_geojson_colors,
+    GEOSPATIAL_FORMATS,
 )
 from utils import shutdown_server, clear_cache
+from db_pool import get_pool_stats
+from result_cache import get_result_cache_stats
+from indexer import schedule_index_build
+from jobs import job_queue
+from artifacts import get_artifact_store_stats
+from serialization import dumps, arrow_available, ARROW_STREAM
+from compression import (
+    negotiate_encoding,
+    read_artifact,
+    store_artifact,
+    encoded_response,
+)
 from validate import (
     validate_get_data_args,
     validate_export_data_args,
@@ -34,6 +55,8 @@ from validate import (
     validate_geospatial_args,
     validate_export_map_args,
     validate_serve_tif_args,
+    validate_build_indexes_args,
+    validate_job_args,
 )
 
 # Load environment variables
@@ -50,6 +73,35 @@ JWT_SECRET_KEY = secrets.token_hex(256)
 # Store revoked tokens
 revoked_tokens = set()
 
+# Layer export formats missing from the mimetypes table
+mimetypes.add_type("application/geopackage+sqlite3", ".gpkg")
+mimetypes.add_type("application/vnd.flatgeobuf", ".fgb")
+
+
+def export_data_file(data, from_body):
+    """
+    Export data to a file for /api/export_data and export jobs. Request bodies without a
+    date type, sent for layer exports of the map, only export the GeoJSON layer.
+    """
+    if from_body:
+        if data.get("date_type", None):
+            is_empty = False
+        else:
+            is_empty = True
+            data["date_type"] = "GeoJson Only"
+        return export_data_service(data, is_empty)
+    return export_data_service(data)
+
+
+def export_mimetype(file_path):
+    # Determine the mimetype based on the file extension
+    file_extension = file_path.split(".")[-1].lower()
+    return (
+        mimetypes.types_map.get(f".{file_extension}", "application/octet-stream")
+        if file_extension != "xlsx"
+        else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
 
 def register_routes(app, cache):
     app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
@@ -88,6 +140,33 @@ def register_routes(app, cache):
         revoked_tokens.add(jti)
         return jsonify({"message": "Logged out successfully"}), 200
 
+    def accepts_arrow():
+        """Whether the client prefers an Arrow IPC stream to JSON and it can be sent."""
+        return (
+            arrow_available()
+            and request.accept_mimetypes.best_match(["application/json", ARROW_STREAM])
+            == ARROW_STREAM
+        )
+
+    def data_cache_key_for_request(*args, **kwargs):
+        """
+        Route cache key shared by equivalent data requests: the canonical request plus any
+        other arguments of the route, such as the feature of the map colours.
+        """
+        try:
+            data_request = DataRequest.from_args(request.args)
+            extra = {
+                key: value
+                for key, value in sorted(request.args.items())
+                if key not in DataRequest.argument_names()
+            }
+            key = data_cache_key(data_request, **extra)
+        except Exception:
+            # Requests that cannot be parsed are cached by their query string
+            key = hashlib.sha256(request.query_string).hexdigest()
+        # Arrow and JSON responses of the same request are cached separately
+        return f"{request.path}:{key}" + (":arrow" if accepts_arrow() else "")
+
     # Token revocation check
     @jwt.token_in_blocklist_loader
     def check_if_token_revoked(jwt_header, jwt_payload):
@@ -162,6 +241,10 @@ def register_routes(app, cache):
             os.makedirs(folder_name, exist_ok=True)
             file.save(file_path)
 
+            # Index the result tables of uploaded databases in the background
+            if file_path.endswith(".db3") and "lookup" not in file_path:
+                schedule_index_build(file_path)
+
         return (
             jsonify({"message": "Files uploaded successfully"}),
             200,
@@ -169,7 +252,7 @@ def register_routes(app, cache):
 
     @app.route("/api/get_data", methods=["GET"])
     @jwt_required()
-    @cache.cached(timeout=300, query_string=True)
+    @cache.cached(timeout=300, make_cache_key=data_cache_key_for_request)
     def get_data():
         data = request.args
 
@@ -178,9 +261,24 @@ def register_routes(app, cache):
         if validation_response.get("error", None):
             return jsonify(validation_response)
 
-        response = fetch_data_service(data)
+        if accepts_arrow():
+            response = fetch_data_arrow_service(data)
+            response = (
+                jsonify(response)
+                if response.get("error", None)
+                else Response(response["stream"], mimetype=ARROW_STREAM)
+            )
+        else:
+            response = fetch_data_service(data)
+            if data.get("format") == "columnar" and not response.get("error", None):
+                # orjson writes the NumPy column arrays without converting every value
+                response = Response(dumps(response), mimetype="application/json")
+            else:
+                response = jsonify(response)
 
-        return jsonify(response)
+        # The same URL returns JSON or Arrow depending on the Accept header
+        response.vary.add("Accept")
+        return response
 
     @app.route("/api/export_data", methods=["GET", "POST"])
     # This endpoint is not cached because the file is generated dynamically
@@ -192,28 +290,33 @@ def register_routes(app, cache):
             return jsonify(validation_response)
 
         if request.method == "POST":
-            if data.get("date_type", None):
-                is_empty = False
-            else:
-                is_empty = True
-                data["date_type"] = "GeoJson Only"
-            file_path = export_data_service(data, is_empty)
+            file_path = export_data_file(data, True)
         else:
-            file_path = export_data_service(data)
+            # Single table csv/txt exports are sent while they are read from the database
+            stream = stream_export_service(data)
+            if stream is not None:
+                if stream.get("error", None):
+                    return jsonify(stream)
+                file_name = os.path.basename(stream["file_path"])
+                response = Response(
+                    stream["stream"],
+                    mimetype=mimetypes.types_map.get(
+                        os.path.splitext(file_name)[1], "text/plain"
+                    ),
+                )
+                response.headers.set(
+                    "Content-Disposition", "attachment", filename=file_name
+                )
+                return response
+            file_path = export_data_file(data, False)
 
         if file_path.get("error", None):
             return jsonify(file_path)
 
-        # Determine the mimetype based on the file extension
-        file_extension = file_path.get("file_path").split(".")[-1].lower()
-        mimetype = (
-            mimetypes.types_map.get(f".{file_extension}", "application/octet-stream")
-            if file_extension != "xlsx"
-            else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-
         return send_file(
-            file_path.get("file_path"), mimetype=mimetype, as_attachment=True
+            file_path.get("file_path"),
+            mimetype=export_mimetype(file_path.get("file_path")),
+            as_attachment=True,
         )
 
     @app.route("/api/get_tables", methods=["GET"])
@@ -271,7 +374,8 @@ def register_routes(app, cache):
 
     @app.route("/api/geospatial", methods=["GET"])
     @jwt_required()
-    @cache.cached(timeout=300, query_string=True)
+    # Not cached by the route cache: the response is kept in the artifact store with its
+    # compressed variants, which differ by the Accept-Encoding of the request
     def geospatial():
         """
         API endpoint to return GeoJSON/Tiff Image Url, bounds, and center.
@@ -283,9 +387,16 @@ def register_routes(app, cache):
         if validation_response.get("error", None):
             return jsonify(validation_response)
 
-        geo_data = process_geospatial_data(data)
+        name = geospatial_artifact_name(data)
+        encoding = negotiate_encoding()
+        artifact = read_artifact(name, encoding)
+        if artifact is None:
+            geo_data = process_geospatial_data(data)
+            if geo_data.get("error", None):
+                return jsonify(geo_data)
+            artifact = store_artifact(name, dumps(geo_data), encoding)
 
-        return jsonify(geo_data)
+        return encoded_response(*artifact)
 
     @app.route("/api/geotiff/<path:filename>", methods=["GET"])
     @jwt_required()
@@ -309,7 +420,7 @@ def register_routes(app, cache):
 
     @app.route("/api/get_geojson_colors", methods=["GET"])
     @jwt_required()
-    @cache.cached(timeout=300, query_string=True)
+    @cache.cached(timeout=300, make_cache_key=data_cache_key_for_request)
     def get_geojson_colors():
         """
         API endpoint to get GeoJSON colors.
@@ -350,6 +461,139 @@ def register_routes(app, cache):
             file_path.get("file_path"), mimetype=mimetype, as_attachment=True
         )
 
+    @app.route("/api/jobs", methods=["POST"])
+    @jwt_required()
+    def create_job():
+        """
+        API endpoint to run an export in the background. Takes the arguments of
+        /api/export_data as JSON, or of /api/export_map as a form with the map image,
+        and returns the job to poll for progress.
+        """
+        data = request.form.to_dict() if request.files else request.json or {}
+
+        # Validate the request arguments
+        validation_response = validate_job_args(data)
+        if validation_response.get("error", None):
+            return jsonify(validation_response)
+
+        if data.get("type", "export_data") == "export_data":
+            validation_response = validate_export_data_args(data)
+            # Layer exports of the map are sent as bodies like their POST requests
+            job_args = (
+                export_data_file,
+                data,
+                data.get("export_format") in GEOSPATIAL_FORMATS,
+            )
+        else:
+            image = request.files.get("image")
+            if image is None:
+                return jsonify({"error": "Missing map image"})
+            validation_response = validate_export_map_args(image, data)
+            # The uploaded image can only be read during the request
+            job_args = (export_map_service, io.BytesIO(image.read()), data)
+        if validation_response.get("error", None):
+            return jsonify(validation_response)
+
+        job = job_queue.submit(
+            data.get("type", "export_data"), get_jwt_identity(), *job_args
+        )
+        if job is None:
+            return (
+                jsonify({"error": "Too many exports are queued, try again later."}),
+                429,
+            )
+        return jsonify(job.to_dict()), 202
+
+    @app.route("/api/jobs/<job_id>", methods=["GET"])
+    @jwt_required()
+    def job_status(job_id):
+        """
+        API endpoint to get the status and progress of an export job.
+        """
+        job = job_queue.get(job_id, get_jwt_identity())
+        if job is None:
+            return jsonify({"error": "Export job not found"}), 404
+        return jsonify(job.to_dict())
+
+    @app.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+    @jwt_required()
+    def cancel_job(job_id):
+        """
+        API endpoint to cancel an export job. Running exports stop at their next step.
+        """
+        job = job_queue.cancel(job_id, get_jwt_identity())
+        if job is None:
+            return jsonify({"error": "Export job not found"}), 404
+        return jsonify(job.to_dict())
+
+    @app.route("/api/jobs/<job_id>/download", methods=["GET"])
+    @jwt_required()
+    def download_job(job_id):
+        """
+        API endpoint to download the file of a finished export job.
+        """
+        job = job_queue.get(job_id, get_jwt_identity())
+        if job is None:
+            return jsonify({"error": "Export job not found"}), 404
+        if job.status != "done":
+            return jsonify({"error": f"Export job is {job.status}"}), 409
+
+        file_path = job_queue.file_path(job)
+        if file_path is None:
+            return jsonify({"error": "The export file expired, export it again."}), 410
+        return send_file(
+            file_path,
+            mimetype=export_mimetype(file_path),
+            as_attachment=True,
+            download_name=job.file_name,
+        )
+
+    @app.route("/api/build_indexes", methods=["POST"])
+    @jwt_required()
+    def build_indexes():
+        """
+        API endpoint to build the (ID, date) indexes of a database in the background.
+        """
+        data = request.json
+
+        # Validate the request arguments
+        validation_response = validate_build_indexes_args(data)
+        if validation_response.get("error", None):
+            return jsonify(validation_response)
+
+        db_path = safe_join(Config.PATHFILE, data.get("db_path"))
+        if not db_path or not os.path.exists(db_path):
+            return jsonify({"error": "Invalid path specified for the database."})
+
+        if not schedule_index_build(db_path):
+            return jsonify({"message": "Index build already in progress"}), 200
+
+        return jsonify({"message": "Index build started"}), 202
+
+    @app.route("/api/db_pool_stats", methods=["GET"])
+    @jwt_required()
+    def db_pool_stats():
+        """
+        API endpoint to get the SQLite connection pool hit/miss counters.
+        """
+        return jsonify(get_pool_stats())
+
+    @app.route("/api/result_cache_stats", methods=["GET"])
+    @jwt_required()
+    def result_cache_stats():
+        """
+        API endpoint to get the query result cache hit/miss/eviction counters and size.
+        """
+        return jsonify(get_result_cache_stats())
+
+    @app.route("/api/artifact_store_stats", methods=["GET"])
+    @jwt_required()
+    def artifact_store_stats():
+        """
+        API endpoint to get the export artifact store hit/miss/eviction counters and size.
+        """
+        return jsonify(get_artifact_store_stats())
+
     @app.route("/api/health", methods=["GET"])
     def health():
         return "Server is running...", 200
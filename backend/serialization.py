@@ -0,0 +1,103 @@
+import json
+import numpy as np
+import pandas as pd
+import orjson
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow responses are optional
+    pa = None
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+# Rows per record batch of Arrow streams
+ARROW_BATCH_ROWS = 65536
+
+
+def column_kind(dtype):
+    """JSON friendly name of a column dtype."""
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "int"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if pd.api.types.is_string_dtype(dtype) and dtype != object:
+        return "string"
+    return "object"
+
+
+def column_values(column):
+    """
+    Values of a column for orjson: numeric columns stay NumPy arrays, which orjson writes
+    with NaN as null, other columns become lists with None for missing values.
+    """
+    kind = column_kind(column.dtype)
+    # orjson only writes contiguous arrays
+    if kind == "float" or (kind in ["int", "bool"] and column.hasnans):
+        return np.ascontiguousarray(column.to_numpy(dtype=float, na_value=np.nan))
+    if kind in ["int", "bool"]:
+        return np.ascontiguousarray(column.to_numpy())
+    if kind == "datetime":
+        column = column.dt.strftime("%Y-%m-%d %H:%M:%S")
+    return column.to_numpy(dtype=object, na_value=None).tolist()
+
+
+def frame_to_columnar(df):
+    """Return a DataFrame as {columns, dtypes, data} with one list of values per column."""
+    if df is None:
+        return {"columns": [], "dtypes": [], "data": []}
+    return {
+        "columns": [str(col) for col in df.columns],
+        "dtypes": [column_kind(dtype) for dtype in df.dtypes],
+        "data": [column_values(df.iloc[:, i]) for i in range(df.shape[1])],
+    }
+
+
+def dumps(payload):
+    """Serialise a response with orjson, including NumPy arrays."""
+    return orjson.dumps(
+        payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    )
+
+
+def arrow_available():
+    return pa is not None
+
+
+def frame_to_arrow(df):
+    """
+    Convert a DataFrame to an Arrow table. Numeric and string columns are wrapped without
+    converting their values, object columns mixing numbers and text, like the statistics
+    with their dates, are sent as text.
+    """
+    arrays = []
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        try:
+            arrays.append(pa.Array.from_pandas(column))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(
+                pa.Array.from_pandas(
+                    column.map(lambda value: None if pd.isna(value) else str(value))
+                )
+            )
+    return pa.Table.from_arrays(arrays, names=[str(col) for col in df.columns])
+
+
+def arrow_stream(df, metadata=None):
+    """
+    Serialise a DataFrame in the Arrow IPC stream format, in record batches of
+    ARROW_BATCH_ROWS rows. metadata values are stored as JSON in the schema metadata.
+    """
+    table = frame_to_arrow(df if df is not None else pd.DataFrame())
+    if metadata:
+        table = table.replace_schema_metadata(
+            {key: json.dumps(value, default=str) for key, value in metadata.items()}
+        )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=ARROW_BATCH_ROWS):
+            writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
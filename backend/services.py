@@ -1,4 +1,3 @@
-import sqlite3
 import os
 import pandas as pd
 import numpy as np
@@ -13,247 +12,327 @@ import cmocean.cm
 import itertools
 from sklearn.preprocessing import KBinsDiscretizer
 from scipy.stats import skew
-from matplotlib.ticker import MaxNLocator, LinearLocator
-from cycler import cycler
+from matplotlib.ticker import MaxNLocator
 from config import Config
 from datetime import datetime
 import sys
 import json
+import time
+import logging
+import shutil
+import hashlib
+import tempfile
+import threading
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import replace
 import pyogrio
 from osgeo import ogr, osr, gdal
-from zipfile import ZipFile, ZIP_DEFLATED
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 from werkzeug.utils import safe_join
 import re
 import numexpr as ne
-
+from db_pool import get_connection
+from catalog import get_table_catalog, column_affinity
+from queries import (
+    query_table,
+    iter_table,
+    query_joined_tables,
+    supports_aggregation,
+    JoinNotSupported,
+    SEASON_NAMES,
+)
+from columnar import read_mirror
+from result_cache import result_cache, make_key, frame_size
+from field_weights import get_field_weights
+from request_model import DataRequest, DataResult
+from downsample import downsample
+from serialization import frame_to_columnar, arrow_stream
+from charts import new_figure, save_chart, save_report
+from jobs import report_progress
+from artifacts import artifact_store
+
+logger = logging.getLogger(__name__)
 alias_mapping = {}
 global_dbs_tables_columns = {}
+# Shared by all requests so concurrent requests do not multiply the database reads
+fetch_executor = ThreadPoolExecutor(
+    max_workers=Config.FETCH_WORKERS, thread_name_prefix="fetch"
+)
 os.environ["PROJ_LIB"] = Config.PROJ_LIB
 os.environ["GDAL_DATA"] = Config.GDAL_DATA
 os.environ["PATH"] += os.pathsep + Config.PATH
 bmp_db_path_global = None
+# Map layer export formats: zipped Shapefiles, GeoPackage and FlatGeobuf
+GEOSPATIAL_FORMATS = ["shp", "gpkg", "fgb"]
+# Reprojected layers of shapefiles stored in TEMPDIR, exported through their file names
+GEOSPATIAL_LAYER_SUFFIX = "_output.geojson"
+# Map layers are drawn polygons first, then lines, then points
+GEOMETRY_ORDER = {
+    "Polygon": 1,
+    "MultiPolygon": 1,
+    "LineString": 2,
+    "MultiLineString": 2,
+    "Point": 3,
+    "MultiPoint": 3,
+}
+# Rows of an Excel worksheet, including the header row
+EXCEL_MAX_ROWS = 1048576
+# Rows taken from the DataFrame at a time when writing xlsx exports
+XLSX_CHUNK_ROWS = 65536
+
+
+def replace_nan_with_none(records):
+    for record in records:
+        for key, value in record.items():
+            if (isinstance(value, float) or isinstance(value, int)) and np.isnan(
+                value
+            ):
+                record[key] = None
+    return records
 
 
 def fetch_data_service(data):
-    """Fetch data and statistics from the specified databases and tables."""
-    try:
-        # Extract the required parameters from the request data
-        db_tables = json.loads(data.get("db_tables"))
-        columns = (
-            json.loads(data.get("columns")) if data.get("columns") != "All" else "All"
-        )
-        original_columns = columns if isinstance(columns, list) else []
-        selected_ids = json.loads(data.get("id"))
-        id_column = data.get("id_column", "ID")
-        start_date = data.get("start_date")
-        end_date = data.get("end_date")
-        date_type = data.get("date_type")
-        interval = data.get("interval", "daily")
-        method = json.loads(data.get("method", "['Equal']"))
-        statistics = json.loads(data.get("statistics", "['None']"))
-        month = data.get("month", None)
-        season = data.get("season", None)
-        spatial_scale = data.get("spatial_scale", None)
-        field_selected_ids = data.get("field_selected_ids", [])
-        math_formula = data.get("math_formula", None)
-        stats_df = None
-
-        if spatial_scale == "field":
-            field_selected_ids = selected_ids
-            selected_ids = []
-
-        # Initialize DataFrame to store the merged data
-        df = pd.DataFrame()
+    """
+    JSON form of fetch_data_frames for the /api/get_data route: the page of data and the
+    statistics as records, or as columns with format=columnar.
+    """
+    result = fetch_data_frames(data)
+    if isinstance(result, dict):
+        return result
 
-        # Fetch the data for each database and table, and merge it based on date_type & 'ID'
-        for table in db_tables:
-            try:
-                table_key = f"{(table['db'], table['table'])}"
-                global_columns = global_dbs_tables_columns.get(table_key)
-                ID = (
-                    [id_column]
-                    if global_columns and id_column in global_columns
-                    else []
-                )
-                duplicate_columns = []
-                is_all_columns = False
+    df, page = page_of(downsampled_frame(result, data), data)
+    stats_df = result.stats_df
 
-                if not global_columns:
-                    return {"error": f"No columns found for the table {table_key}"}
+    if data.get("format") == "columnar":
+        # One list of values per column instead of one dictionary per row
+        return {
+            **frame_to_columnar(df),
+            **page,
+            "new_feature": result.new_feature,
+            "stats": frame_to_columnar(stats_df),
+            "timings": result.timings,
+            "cached": result.cached,
+        }
 
-                # Determine which columns to fetch
-                if columns == "All":
-                    # Fetch all columns for the table
-                    fetch_columns = columns
-                    is_all_columns = True
-                else:
-                    fetch_columns = set()
-                    prefix_columns = [
-                        col for col in columns if col.startswith(table["table"])
-                    ]
-
-                    # Check if the table has a prefix
-                    for col in columns:
-                        if col in prefix_columns:
-                            original_col = col[
-                                len(table["table"]) + 1 :
-                            ]  # Strip prefix
-                            if original_col in global_columns:
-                                fetch_columns.add(original_col)
-                                duplicate_columns.append(col)
-                        elif col in global_columns:
-                            # Non-prefixed columns for tables without prefixes
-                            fetch_columns.add(col)
-
-                # Remove fetched columns from columns list
-                columns = (
-                    list(set(columns) - set(fetch_columns)) + [date_type] + ID
-                    if columns != "All"
-                    else "All"
-                )
+    # Return the data and statistics as dictionaries
+    return {
+        "data": replace_nan_with_none(df.to_dict(orient="records")),
+        "new_feature": result.new_feature,
+        "stats": (
+            replace_nan_with_none(stats_df.to_dict(orient="records"))
+            if stats_df is not None
+            else []
+        ),
+        "statsColumns": stats_df.columns.tolist() if stats_df is not None else [],
+        **page,
+        "timings": result.timings,
+        "cached": result.cached,
+    }
 
-                if not fetch_columns:
-                    # If there are no common columns, skip the table
-                    continue
 
-                # Fetch data from the database
-                df_temp = fetch_data_from_db(
-                    table["db"],
-                    table["table"],
-                    selected_ids,
-                    fetch_columns,
-                    start_date,
-                    end_date,
-                    date_type,
-                )
+def downsampled_frame(result, data):
+    """
+    The data of a result, with its series downsampled for charts when max_points is given.
+    The downsampled frame is cached next to the result, so the pages of a downsampled
+    series are sliced from it instead of downsampling the whole result for each page.
+    """
+    max_points = data.get("max_points")
+    if not max_points:
+        return result.df
+    request = DataRequest.from_args(data)
+    key = f"{data_cache_key(request)}:max_points={int(max_points)}"
+    df = result_cache.get(key)
+    if df is None:
+        df = downsample(result.df, request.id_column, request.date_type, max_points)
+        result_cache.put(key, df, frame_size(df))
+    # Equivalent requests share the downsampled frame, apply this request's column order
+    if list(df.columns) != list(result.df.columns):
+        df = df[list(result.df.columns)]
+    return df
+
+
+def page_of(df, data):
+    """
+    Slice the page of rows selected by the offset and limit arguments from a result,
+    the whole result without them. Pages of a request share the result cached by
+    fetch_data_frames, so only the first page computes it.
+    """
+    offset = int(data.get("offset") or 0)
+    limit = int(data["limit"]) if data.get("limit") not in [None, ""] else None
+    page = df.iloc[offset : offset + limit if limit is not None else None]
+    return page, {"total_rows": len(df), "offset": offset, "limit": limit}
 
-                # Rename columns to table-column format
-                for col in duplicate_columns:
-                    col_temp = col[len(table["table"]) + 1 :]
-                    if col_temp in df_temp.columns:
-                        df_temp.rename(columns={col_temp: col}, inplace=True)
 
-                # Merge the dataframes on date_type and 'ID' columns
-                if df.empty:
-                    df = df_temp
-                else:
-                    # Case of All columns, rename columns to table-column format
-                    if is_all_columns:
-                        for col in df.columns:
-                            if col in df_temp.columns and col not in [date_type, id_column]:
-                                df_temp.rename(
-                                    columns={col: f"{table['table']}-{col}"},
-                                    inplace=True,
-                                )
-
-                    # Identify columns for merging; ignore columns with dash if they represent different data sources
-                    merge_on_columns = [col for col in df.columns if "ID" in col]
-                    for col in df.columns:
-                        if col in df_temp.columns and not col.startswith(
-                            table["table"]
-                        ):
-                            merge_on_columns.append(col)
-                    df = pd.merge(df, df_temp, on=merge_on_columns, how="outer")
-                    # Drop rows with NaN in the required columns
-                    df.dropna(inplace=True, how="all")
-            except Exception as e:
-                return {"error": f"Error while processing table {table_key}: {str(e)}"}
+def fetch_data_arrow_service(data):
+    """
+    Return the data, or the statistics with result=stats, of a request as an Arrow IPC
+    stream. The other response fields, such as the page position of the data, are stored
+    in the schema metadata.
+    """
+    result = fetch_data_frames(data)
+    if isinstance(result, dict):
+        return result
 
-        # If the DataFrame is empty after merging, return an error
-        if df.empty:
-            return {"error": "No data found for the specified filters."}
+    if data.get("result") == "stats":
+        df, page = result.stats_df, {}
+    else:
+        df, page = page_of(downsampled_frame(result, data), data)
+    metadata = {
+        **page,
+        "new_feature": result.new_feature,
+        "timings": result.timings,
+        "cached": result.cached,
+    }
+    return {"stream": arrow_stream(df, metadata)}
 
-        ID = id_column
 
-        if spatial_scale == "field":
-            # Connect to BMP.db3 to fetch subarea information
-            bmp_db_path = safe_join(Config.PATHFILE, bmp_db_path_global)
-            conn = sqlite3.connect(bmp_db_path)
+def fetch_data_frames(data):
+    """
+    Return the DataResult of a request from the shared result cache, computing it on a
+    miss, or an error dictionary. The frames are shared and must not be modified in place.
+    """
+    try:
+        request = DataRequest.from_args(data)
+    except Exception as e:
+        return {"error": f"Invalid parameters: {str(e)}"}
 
-            try:
-                # Get the ID column name for Subarea table
-                query = f"PRAGMA table_info('Subarea')"
-                cursor = conn.cursor()
-                cursor.execute(query)
-                subarea_id = next(
-                    (col[1] for col in cursor.fetchall() if "id" in col[1].lower()),
-                    "ID",
-                )
+    key = data_cache_key(request)
+    result = result_cache.get(key)
+    if result is not None:
+        # Nothing was fetched for this request
+        result = replace(result, timings=[], cached=True)
+    else:
+        result = compute_data_frames(request)
+        if isinstance(result, dict):
+            return result
+        result_cache.put(key, result, result.size())
 
-                # Read Subarea information (Id, FieldId, and Area) from the Subarea table
-                query = f"SELECT {subarea_id} AS '{ID}', FieldId, Area FROM Subarea"
-                params = []
-
-                # Add conditions for selected field IDs
-                if field_selected_ids:
-                    placeholders = ",".join(["?"] * len(field_selected_ids))
-                    query += f" WHERE FieldId IN ({placeholders})"
-                    params.extend(field_selected_ids)
-                subarea_df = pd.read_sql_query(query, conn, params=params)
-
-                # Ensure the required columns exist in the DataFrame
-                if (
-                    ID not in subarea_df.columns
-                    or "FieldId" not in subarea_df.columns
-                    or "Area" not in subarea_df.columns
-                ):
-                    return {
-                        "error": "Subarea table does not contain the required columns: ID, FieldId, Area"
-                    }
+    # Equivalent requests share the cached frames, so apply this request's column order
+    if request.columns != "All" and list(result.df.columns) != list(request.columns):
+        result = replace(result, df=result.df[list(request.columns)])
+    return result
 
-                # Calculate the total area for each field
-                field_area_df = (
-                    subarea_df.groupby(["FieldId"])["Area"].sum().reset_index()
-                )
-                field_area_df.rename(columns={"Area": "Total_Area"}, inplace=True)
 
-                # Merge the total field area back into the subarea DataFrame
-                subarea_df = subarea_df.merge(field_area_df, on="FieldId")
+def data_cache_key(request, **extra):
+    """
+    Cache key of a data request: its canonical parameters plus the databases it reads,
+    and BMP.db3 for field values.
+    """
+    file_paths = [safe_join(Config.PATHFILE, db) for db, _ in request.db_tables]
+    if request.spatial_scale == "field" and bmp_db_path_global:
+        file_paths.append(safe_join(Config.PATHFILE, bmp_db_path_global))
+    return request.cache_key([path for path in file_paths if path], **extra)
 
-                # Calculate the area fraction for each subarea within its field
-                subarea_df["Area_Fraction"] = (
-                    subarea_df["Area"] / subarea_df["Total_Area"]
-                )
 
-                date_type_list = [date_type] if date_type else []
+def compute_data_frames(request):
+    """
+    Fetch data and compute statistics from the specified databases and tables, as a
+    DataResult or an error dictionary.
+    """
+    try:
+        # Extract the required parameters from the request
+        db_tables = [{"db": db, "table": table} for db, table in request.db_tables]
+        columns = list(request.columns) if request.columns != "All" else "All"
+        original_columns = columns if isinstance(columns, list) else []
+        selected_ids = list(request.ids)
+        id_column = request.id_column
+        start_date = request.start_date
+        end_date = request.end_date
+        date_type = request.date_type
+        interval = request.interval
+        method = list(request.method)
+        statistics = list(request.statistics)
+        month = request.month
+        season = request.season
+        spatial_scale = request.spatial_scale
+        field_selected_ids = []
+        math_formula = request.math_formula
+        stats_df = None
+        timings = []
 
-                # Merge the subarea values from the main DataFrame (df) into the subarea DataFrame
-                subarea_values = (
-                    df.set_index([ID, *date_type_list])
-                    .select_dtypes(include=["number"])
-                    .reset_index()
-                )
-                subarea_values.rename(columns={ID: "Subarea_ID"}, inplace=True)
-                subarea_df = subarea_df.merge(
-                    subarea_values, left_on=ID, right_on="Subarea_ID", how="left"
+        field_weights = None
+        if spatial_scale == "field":
+            field_selected_ids = selected_ids
+            selected_ids = []
+            try:
+                field_weights = get_field_weights(
+                    safe_join(Config.PATHFILE, bmp_db_path_global)
                 )
+            except ValueError as e:
+                return {"error": str(e)}
+            except Exception as e:
+                return {"error": f"Error processing field values: {str(e)}"}
+            # Only the subareas within the selected fields are needed
+            if field_selected_ids:
+                selected_ids = field_weights.subareas(field_selected_ids)
+
+        # Work out which columns to fetch from each database and table
+        table_fetches = plan_table_fetches(db_tables, columns, id_column, date_type)
+        if isinstance(table_fetches, dict):
+            return table_fetches
+
+        # Sum the rows per ID and period in SQLite when no later step needs the daily rows
+        aggregation = None
+        if (
+            "Equal" not in method
+            and interval in ["monthly", "yearly", "seasonally"]
+            and date_type in ["Time", "Date"]
+            and spatial_scale != "field"
+            and not math_formula
+            and can_aggregate_in_sql(table_fetches, id_column, date_type)
+        ):
+            aggregation = {"interval": interval, "month": month, "season": season}
+
+        # Join the tables in a single SQLite query when they share the ID and date key
+        try:
+            df = fetch_joined_data(
+                table_fetches,
+                selected_ids,
+                id_column,
+                start_date,
+                end_date,
+                date_type,
+                aggregation,
+                timings,
+            )
+        except JoinNotSupported:
+            # Fall back to fetching and merging the tables one by one
+            df = None
+        except Exception:
+            # Other errors are bugs of the join, the pandas merge still answers
+            logger.exception("Joined query failed, merging the tables in pandas")
+            df = None
+
+        if df is None:
+            # Tables merged in pandas are aggregated after the merge
+            if len(table_fetches) > 1:
+                aggregation = None
+            df = merge_table_fetches(
+                table_fetches,
+                selected_ids,
+                id_column,
+                start_date,
+                end_date,
+                date_type,
+                aggregation,
+                timings,
+            )
+            if isinstance(df, dict):
+                return df
 
-                # Calculate the area-weighted field values for all numerical columns
-                weighted_columns = []
-                for col in subarea_values.columns:
-                    if col not in [
-                        "Subarea_ID",
-                        *date_type_list,
-                    ]:  # Skip the ID and Date column
-                        subarea_df[col] = subarea_df[col] * subarea_df["Area_Fraction"]
-                        weighted_columns.append(col)
-
-                # Aggregate the weighted values to calculate the field values
-                field_values_df = (
-                    subarea_df.groupby(["FieldId", *date_type_list])[weighted_columns]
-                    .sum()
-                    .reset_index()
-                )
-                field_values_df.rename(columns={"FieldId": ID}, inplace=True)
+        # If the DataFrame is empty after merging, return an error
+        if df.empty:
+            return {"error": "No data found for the specified filters."}
 
-                # Replace the original DataFrame's values with the calculated field values
-                df = field_values_df.copy().map(round_numeric_values)
+        ID = id_column
 
+        if spatial_scale == "field":
+            try:
+                # Weight the subarea values by their area fraction within each field
+                df = field_weights.field_values(df, ID, date_type, field_selected_ids)
             except Exception as e:
                 return {"error": f"Error processing field values: {str(e)}"}
-            finally:
-                conn.close()
         elif spatial_scale == "reach":
             # Select all IDs except 0 as Reach ID = 0 is used for watershed average
             df = df[df[ID] != 0]
@@ -262,98 +341,12 @@ def fetch_data_service(data):
                 "error": "Spatial scale is unknown. Please select a valid spatial scale."
             }
 
-        # Combine all numerical columns in df.columns except 'ID' using the specified math_sign
-        numerical_columns = [
-            col for col in df.select_dtypes(include=["number"]).columns if col != ID
-        ]
-        new_feature = ""
-
-        # Parse and evaluate the formula dynamically
-        if math_formula:
-            try:
-                # Replace column names in the formula with their corresponding DataFrame references
-                formula = math_formula
-                formula_symbols = math_formula
-                for col in numerical_columns:
-                    formula = formula.replace(col, f"df['{col}']", 1)
-                    # Remove column names from the formula symbols
-                    formula_symbols = formula_symbols.replace(col, "", 1)
-
-                # Check if formula only contains allowed mathematical operators and column names
-                formula_symbols = set(list(formula_symbols))
-
-                if not all(
-                    char.isnumeric() or char in "+-*/,." or char.isspace()
-                    for char in formula_symbols
-                ):
-                    return {"error": "Invalid characters or columns in the formula."}
-
-                # Create a mapping of alias to real column names
-                real_col = {
-                    col: columns_dict[col]
-                    for table in db_tables
-                    for col in numerical_columns
-                    if col
-                    in (
-                        columns_dict := alias_mapping.get(table["table"], {}).get(
-                            "columns", {}
-                        )
-                    )
-                }
-
-                special_chars = "!@#$%^&()_+-*/.|~/`{}[]:;\"\\'<>,?0123456789 "
-
-                # Replace only column names in the formula, ignoring operators
-                new_feature = math_formula
-                for col in numerical_columns:
-                    if col in real_col:
-                        new_feature = new_feature.replace(col, real_col.get(col, col))
-                    math_formula = math_formula.replace(
-                        col,
-                        re.sub(f"[{re.escape(special_chars)}]", "", col),
-                        1,
-                    )
-
-                # Handle division by zero by replacing zeros with a small number (e.g., 0.001) in the DataFrame
-                if "/" in formula_symbols:
-                    # Extract the column names involved in division (after '/')
-                    div_columns = re.findall(
-                        r"(df\['([^']*)'\]|\d+(\.\d+)?)\s*\/\s*df\['([^']*)'\]",
-                        formula,
-                    )
-                    for col_denum in div_columns:
-                        df[col_denum[-1]] = df[col_denum[-1]].replace(0, 0.001)
-
-                # Prepare the local_dict with column data
-                local_dict = {
-                    re.sub(f"[{re.escape(special_chars)}]", "", col)
-                    .strip(): df[col]
-                    .values
-                    for col in numerical_columns
-                }
-
-                # Evaluate the formula to update the existing columns or create new one
-                if "," in math_formula:
-                    # Handle multiple columns in the formula, update existing columns
-                    math_formulas = math_formula.split(",")
-                    new_feature = ""
-                    for col_name in numerical_columns:
-                        for col_formula in math_formulas:
-                            if (
-                                re.sub(f"[{re.escape(special_chars)}]", "", col_name)
-                                in col_formula
-                            ):
-                                # Evaluate the formula and assign it to the new column
-                                df[col_name] = ne.evaluate(
-                                    col_formula.strip(), local_dict=local_dict
-                                )
-                else:
-                    # Evaluate the formula and assign it to the new column
-                    df[new_feature] = ne.evaluate(
-                        math_formula.strip(), local_dict=local_dict
-                    )
-            except Exception as e:
-                return {"error": f"Error evaluating formula: {str(e)}"}
+        # Evaluate the math formula, if any, over the numerical columns
+        formula_result = apply_math_formula(df, math_formula, db_tables, ID)
+        if formula_result.get("error", None):
+            return formula_result
+        df = formula_result["df"]
+        new_feature = formula_result["new_feature"]
 
         # Perform time conversion and aggregation if necessary
         if "Equal" not in method and interval != "daily":
@@ -361,9 +354,13 @@ def fetch_data_service(data):
                 return {
                     "error": "Time conversion and statistics cannot be performed for non-time series data"
                 }
-            df, stats_df = aggregate_data(
-                df, interval, method, date_type, month, season
-            )
+            if aggregation:
+                # The rows were already summed per period by SQLite
+                stats_df = calculate_statistics(df, method, date_type)
+            else:
+                df, stats_df = aggregate_data(
+                    df, interval, method, date_type, month, season
+                )
         elif "None" not in statistics:
             if not date_type:
                 return {
@@ -371,55 +368,470 @@ def fetch_data_service(data):
                 }
             stats_df = calculate_statistics(df, statistics, date_type)
 
-        def replace_nan_with_none(records):
-            for record in records:
-                for key, value in record.items():
-                    if (
-                        isinstance(value, float) or isinstance(value, int)
-                    ) and np.isnan(value):
-                        record[key] = None
-            return records
-        
         # Order the columns in the DataFrame based on the original columns
         if original_columns:
             df = df[original_columns]
 
-        # Return the data and statistics as dictionaries
-        return {
-            "data": replace_nan_with_none(
-                df.map(round_numeric_values).to_dict(orient="records")
-            ),
-            "new_feature": new_feature,
-            "stats": (
-                replace_nan_with_none(stats_df.to_dict(orient="records"))
-                if stats_df is not None
-                else []
-            ),
-            "statsColumns": stats_df.columns.tolist() if stats_df is not None else [],
-        }
+        # Round once the values are final, the statistics are computed on full precision
+        return DataResult(
+            df=round_numeric_frame(df),
+            stats_df=round_numeric_frame(stats_df) if stats_df is not None else None,
+            new_feature=new_feature,
+            timings=timings,
+        )
     except Exception as e:
         return {"error": str(e)}
 
 
+def plan_table_fetches(db_tables, columns, id_column, date_type):
+    """
+    Work out which columns to fetch from each database and table of a request.
+    Returns the list of table fetches or an error.
+    """
+    table_fetches = []
+    for table in db_tables:
+        table_key = f"{(table['db'], table['table'])}"
+        global_columns = global_dbs_tables_columns.get(table_key)
+        ID = [id_column] if global_columns and id_column in global_columns else []
+        duplicate_columns = []
+        is_all_columns = False
+
+        if not global_columns:
+            return {"error": f"No columns found for the table {table_key}"}
+
+        # Determine which columns to fetch
+        if columns == "All":
+            # Fetch all columns for the table
+            fetch_columns = columns
+            is_all_columns = True
+        else:
+            fetch_columns = set()
+            prefix_columns = [
+                col for col in columns if col.startswith(table["table"])
+            ]
+
+            # Check if the table has a prefix
+            for col in columns:
+                if col in prefix_columns:
+                    original_col = col[len(table["table"]) + 1 :]  # Strip prefix
+                    if original_col in global_columns:
+                        fetch_columns.add(original_col)
+                        duplicate_columns.append(col)
+                elif col in global_columns:
+                    # Non-prefixed columns for tables without prefixes
+                    fetch_columns.add(col)
+
+        # Remove fetched columns from columns list
+        columns = (
+            list(set(columns) - set(fetch_columns)) + [date_type] + ID
+            if columns != "All"
+            else "All"
+        )
+
+        if not fetch_columns:
+            # If there are no common columns, skip the table
+            continue
+
+        table_fetches.append(
+            {
+                "table": table,
+                "table_key": table_key,
+                "fetch_columns": fetch_columns,
+                "duplicate_columns": duplicate_columns,
+                "is_all_columns": is_all_columns,
+            }
+        )
+
+    return table_fetches
+
+
+def apply_math_formula(df, math_formula, db_tables, ID):
+    """
+    Evaluate a math formula over the numeric columns of a DataFrame, updating the
+    columns named in a comma separated formula or adding a new feature column.
+    Returns {"df", "new_feature"} or an error.
+    """
+    # Combine all numerical columns in df.columns except 'ID' using the specified math_sign
+    numerical_columns = [
+        col for col in df.select_dtypes(include=["number"]).columns if col != ID
+    ]
+    new_feature = ""
+
+    # Parse and evaluate the formula dynamically
+    if math_formula:
+        try:
+            # Replace column names in the formula with their corresponding DataFrame references
+            formula = math_formula
+            formula_symbols = math_formula
+            for col in numerical_columns:
+                formula = formula.replace(col, f"df['{col}']", 1)
+                # Remove column names from the formula symbols
+                formula_symbols = formula_symbols.replace(col, "", 1)
+
+            # Check if formula only contains allowed mathematical operators and column names
+            formula_symbols = set(list(formula_symbols))
+
+            if not all(
+                char.isnumeric() or char in "+-*/,." or char.isspace()
+                for char in formula_symbols
+            ):
+                return {"error": "Invalid characters or columns in the formula."}
+
+            # Create a mapping of alias to real column names
+            real_col = {
+                col: columns_dict[col]
+                for table in db_tables
+                for col in numerical_columns
+                if col
+                in (
+                    columns_dict := alias_mapping.get(table["table"], {}).get(
+                        "columns", {}
+                    )
+                )
+            }
+
+            special_chars = "!@#$%^&()_+-*/.|~/`{}[]:;\"\\'<>,?0123456789 "
+
+            # Replace only column names in the formula, ignoring operators
+            new_feature = math_formula
+            for col in numerical_columns:
+                if col in real_col:
+                    new_feature = new_feature.replace(col, real_col.get(col, col))
+                math_formula = math_formula.replace(
+                    col,
+                    re.sub(f"[{re.escape(special_chars)}]", "", col),
+                    1,
+                )
+
+            # Handle division by zero by replacing zeros with a small number (e.g., 0.001) in the DataFrame
+            if "/" in formula_symbols:
+                # Extract the column names involved in division (after '/')
+                div_columns = re.findall(
+                    r"(df\['([^']*)'\]|\d+(\.\d+)?)\s*\/\s*df\['([^']*)'\]",
+                    formula,
+                )
+                for col_denum in div_columns:
+                    df[col_denum[-1]] = df[col_denum[-1]].replace(0, 0.001)
+
+            # Prepare the local_dict with column data
+            local_dict = {
+                re.sub(f"[{re.escape(special_chars)}]", "", col)
+                .strip(): df[col]
+                .values
+                for col in numerical_columns
+            }
+
+            # Evaluate the formula to update the existing columns or create new one
+            if "," in math_formula:
+                # Handle multiple columns in the formula, update existing columns
+                math_formulas = math_formula.split(",")
+                new_feature = ""
+                for col_name in numerical_columns:
+                    for col_formula in math_formulas:
+                        if (
+                            re.sub(f"[{re.escape(special_chars)}]", "", col_name)
+                            in col_formula
+                        ):
+                            # Evaluate the formula and assign it to the new column
+                            df[col_name] = ne.evaluate(
+                                col_formula.strip(), local_dict=local_dict
+                            )
+            else:
+                # Evaluate the formula and assign it to the new column
+                df[new_feature] = ne.evaluate(
+                    math_formula.strip(), local_dict=local_dict
+                )
+        except Exception as e:
+            return {"error": f"Error evaluating formula: {str(e)}"}
+
+    return {"df": df, "new_feature": new_feature}
+
+
+def can_aggregate_in_sql(table_fetches, id_column, date_type):
+    """Check that every selected table can be summed per ID and period by SQLite."""
+    if not table_fetches or not id_column:
+        return False
+    for fetch in table_fetches:
+        table = fetch["table"]
+        db_path = safe_join(Config.PATHFILE, table["db"])
+        real_table_name = alias_mapping.get(table["table"], {}).get(
+            "real", table["table"]
+        )
+        real_columns = (
+            None
+            if fetch["is_all_columns"]
+            else [
+                alias_mapping.get(table["table"], {}).get("columns", {}).get(col, col)
+                for col in fetch["fetch_columns"]
+            ]
+        )
+        if not supports_aggregation(
+            db_path, real_table_name, real_columns, id_column, date_type
+        ):
+            return False
+    return True
+
+
+def fetch_joined_data(
+    table_fetches,
+    selected_ids,
+    id_column,
+    start_date,
+    end_date,
+    date_type,
+    aggregation=None,
+    timings=None,
+):
+    """
+    Fetch and outer join several tables in one SQLite query on the ID and date columns.
+    Returns None for selections the join cannot express and raises JoinNotSupported when
+    SQLite cannot run it, so that they are merged in pandas instead.
+    """
+    if len(table_fetches) < 2 or not id_column or not date_type:
+        return None
+
+    tables = []
+    output_columns = set()
+    for fetch in table_fetches:
+        table = fetch["table"]
+        db_path = safe_join(Config.PATHFILE, table["db"])
+        real_table_name = alias_mapping.get(table["table"], {}).get(
+            "real", table["table"]
+        )
+        alias_columns = alias_mapping.get(real_table_name, {}).get("columns", {})
+
+        if fetch["is_all_columns"]:
+            real_columns = get_table_catalog(db_path, real_table_name)["columns"]
+        else:
+            real_columns = [
+                alias_mapping.get(table["table"], {}).get("columns", {}).get(col, col)
+                for col in fetch["fetch_columns"]
+            ]
+
+        # Output names follow the alias and table prefix renaming of the pandas path
+        renames = {
+            col[len(table["table"]) + 1 :]: col for col in fetch["duplicate_columns"]
+        }
+        columns = []
+        for real in real_columns:
+            name = alias_columns.get(real, real) if id_column not in real else real
+            name = renames.get(name, name)
+            if name in [id_column, date_type]:
+                if name != real:
+                    return None
+            else:
+                if fetch["is_all_columns"] and name in output_columns:
+                    name = f"{table['table']}-{name}"
+                # Shared or extra ID columns would be merge keys in pandas
+                if name in output_columns or "ID" in name:
+                    return None
+            columns.append((real, name))
+
+        names = [name for _, name in columns]
+        if id_column not in names or date_type not in names:
+            return None
+
+        output_columns.update(names)
+        tables.append(
+            {"db_path": db_path, "table": real_table_name, "columns": columns}
+        )
+
+    start = time.perf_counter()
+    df = query_joined_tables(
+        tables, id_column, date_type, selected_ids, start_date, end_date, aggregation
+    )
+    if timings is not None:
+        timings.append(
+            {
+                "tables": [fetch["table_key"] for fetch in table_fetches],
+                "rows": len(df),
+                "seconds": round(time.perf_counter() - start, 4),
+            }
+        )
+
+    # Drop rows with NaN in the required columns
+    df.dropna(inplace=True, how="all")
+    return df
+
+
+def merge_table_fetches(
+    table_fetches,
+    selected_ids,
+    id_column,
+    start_date,
+    end_date,
+    date_type,
+    aggregation=None,
+    timings=None,
+):
+    """
+    Fetch the tables concurrently and merge them in pandas on the date_type and ID columns.
+    The merge follows the order of table_fetches, whichever fetch finishes first.
+    """
+
+    def fetch_table(fetch):
+        start = time.perf_counter()
+        df_temp = fetch_data_from_db(
+            fetch["table"]["db"],
+            fetch["table"]["table"],
+            selected_ids,
+            fetch["fetch_columns"],
+            start_date,
+            end_date,
+            date_type,
+            aggregation,
+        )
+        return df_temp, time.perf_counter() - start
+
+    # sqlite3 releases the GIL while a query runs, so the databases are read in parallel
+    futures = [fetch_executor.submit(fetch_table, fetch) for fetch in table_fetches]
+    df = pd.DataFrame()
+
+    for fetch, future in zip(table_fetches, futures):
+        table = fetch["table"]
+        try:
+            df_temp, seconds = future.result()
+            if timings is not None:
+                timings.append(
+                    {
+                        "tables": [fetch["table_key"]],
+                        "rows": len(df_temp),
+                        "seconds": round(seconds, 4),
+                    }
+                )
+
+            # Rename columns to table-column format
+            for col in fetch["duplicate_columns"]:
+                col_temp = col[len(table["table"]) + 1 :]
+                if col_temp in df_temp.columns:
+                    df_temp.rename(columns={col_temp: col}, inplace=True)
+
+            # Merge the dataframes on date_type and 'ID' columns
+            if df.empty:
+                df = df_temp
+            else:
+                # Case of All columns, rename columns to table-column format
+                if fetch["is_all_columns"]:
+                    for col in df.columns:
+                        if col in df_temp.columns and col not in [date_type, id_column]:
+                            df_temp.rename(
+                                columns={col: f"{table['table']}-{col}"},
+                                inplace=True,
+                            )
+
+                # Identify columns for merging; ignore columns with dash if they represent different data sources
+                merge_on_columns = [col for col in df.columns if "ID" in col]
+                for col in df.columns:
+                    if col in df_temp.columns and not col.startswith(table["table"]):
+                        merge_on_columns.append(col)
+                df = pd.merge(df, df_temp, on=merge_on_columns, how="outer")
+                # Drop rows with NaN in the required columns
+                df.dropna(inplace=True, how="all")
+        except Exception as e:
+            return {
+                "error": f"Error while processing table {fetch['table_key']}: {str(e)}"
+            }
+
+    return df
+
+
+# Export arguments that change the file, besides the data request
+EXPORT_SETTINGS = [
+    "export_format",
+    "options",
+    "columns",
+    "id",
+    "graph_type",
+    "multi_graph_type",
+    "feature",
+    "feature_statistic",
+    "default_crs",
+    "report",
+]
+
+
+def export_cache_key(data, is_empty=False):
+    """
+    Key of an export file in the artifact store: the data request with the size and mtime
+    of its databases, the export settings in the order they were sent, the size and mtime
+    of its map layers or a digest of the uploaded GeoJSON. None when the request can not
+    be parsed.
+    """
+    try:
+        request = DataRequest.from_args(data)
+        layer_handles = json.loads(data.get("layer_handles") or "[]")
+    except Exception:
+        return None
+    geojson_data = data.get("geojson_data")
+    if geojson_data is not None and not isinstance(geojson_data, str):
+        geojson_data = json.dumps(geojson_data, sort_keys=True)
+    return "export_" + data_cache_key(
+        request,
+        export={name: data.get(name) for name in EXPORT_SETTINGS},
+        geojson=(
+            hashlib.sha256(geojson_data.encode("utf-8")).hexdigest()
+            if geojson_data
+            else None
+        ),
+        layers=(
+            make_key(layer_handles, geospatial_layer_paths(layer_handles) or [])
+            if layer_handles
+            else None
+        ),
+        is_empty=is_empty,
+    )
+
+
+def copy_cached_export(key, export_path, output_filename):
+    """
+    Copy the stored file of an identical export to the export folder under the requested
+    name, returning its path, or None if it is not stored.
+    """
+    cached_path = artifact_store.get(key) if key else None
+    if cached_path is None:
+        return None
+    file_path = export_file_path(
+        export_path, output_filename + os.path.splitext(cached_path)[1]
+    )
+    try:
+        shutil.copyfile(cached_path, file_path)
+    except FileNotFoundError:
+        # Evicted since it was looked up
+        return None
+    return file_path
+
+
 def export_data_service(data, is_empty=False):
-    """Export data and statistics to a file in the specified format."""
+    """
+    Export data and statistics to a file in the specified format. Repeats of an export
+    are copied from the artifact store instead of being generated again.
+    """
     try:
-        # Fetch the data and statistics from the fetch_data_service
-        output = fetch_data_service(data) if not is_empty else {}
-        if output.get("error", None):
+        output_filename = data.get(
+            "export_filename",
+            f"exported_data_{datetime.now().strftime('%Y%m%d%H%M%S')}",
+        )
+        output_path = data.get("export_path", "dataExport")
+        key = export_cache_key(data, is_empty)
+        file_path = copy_cached_export(key, output_path, output_filename)
+        if file_path is not None:
+            return {"file_path": file_path}
+
+        # Fetch the data and statistics, shared with get_data through the result cache
+        report_progress(0.0, "Fetching data")
+        output = fetch_data_frames(data) if not is_empty else DataResult(df=None)
+        if isinstance(output, dict):
             return output
-        df = pd.DataFrame(output["data"]) if output.get("data", None) else None
+        # The frames are shared, save_to_file only replaces their columns
+        df = output.df if output.df is not None and not output.df.empty else None
         stats_df = (
-            pd.DataFrame(output["stats"]) if output.get("statsColumns", None) else None
+            output.stats_df
+            if output.stats_df is not None and len(output.stats_df.columns)
+            else None
         )
 
         # Extract the required parameters from the request data
-        output_filename = data.get(
-            "export_filename",
-            f"exported_data_{datetime.now().strftime('%Y%m%d%H%M%S')}",
-        )
         output_format = data.get("export_format", "csv")
-        output_path = data.get("export_path", "dataExport")
         # Handle options json stringify
         options = json.loads(data.get("options", "{'table': true, 'stats': true}"))
         columns_list = (
@@ -428,7 +840,6 @@ def export_data_service(data, is_empty=False):
         id_column = data.get("id_column", "ID")
         date_type = data.get("date_type")
         graph_type = data.get("graph_type", "scatter")
-        geojson_data = json.loads(data.get("geojson_data", "{}"))
         feature = data.get("feature", "value")
         feature_statistic = data.get("feature_statistic", "mean")
         default_crs = data.get("default_crs", "EPSG:4326")
@@ -443,13 +854,19 @@ def export_data_service(data, is_empty=False):
                 if not column.endswith(id_column) and column != date_type
             ]
 
-        if not date_type and output_format not in ["csv", "txt", "shp"]:
+        if not date_type and output_format not in ["csv", "txt"] + GEOSPATIAL_FORMATS:
             return {
                 "error": "Graph creation cannot be performed for non-time series data"
             }
+        if data.get("report") == "per_id" and output_format != "pdf":
+            return {"error": "Per-ID reports can only be exported as pdf"}
+        layer = load_export_layer(data) if output_format in GEOSPATIAL_FORMATS else None
+        if isinstance(layer, dict):
+            return layer
 
         # Save the data and statistics to the specified file format
         # Perform graph creation if the output format is an image or excel format
+        report_progress(0.3, "Writing the export file")
         file_path = save_to_file(
             df,
             stats_df,
@@ -459,69 +876,179 @@ def export_data_service(data, is_empty=False):
             options,
             date_type,
             multi_graph_type,
-            geojson_data,
+            layer,
             feature,
             feature_statistic,
             data.get("spatial_scale"),
             default_crs,
             list(map(int, json.loads(data.get("id")))) if data.get("id") != [] else [],
             is_empty,
+            data.get("report"),
         )
 
+        if key:
+            artifact_store.put(key, file_path)
         return {"file_path": file_path}
     except Exception as e:
         return {"error": str(e)}
 
 
-def fetch_data_from_db(
-    db_path, table_name, selected_ids, columns, start_date, end_date, date_type
-):
-    """Fetch data from a SQLite database table with real-to-alias mapping."""
-    conn = sqlite3.connect(safe_join(Config.PATHFILE, db_path))
+def stream_export_service(data):
+    """
+    Export a single table to csv/txt chunk by chunk from the SQLite cursor, writing each
+    chunk to the export file as it is sent. Returns None when the export needs the whole
+    table at once (several tables to merge, aggregation, statistics, field values) or its
+    result is already cached, so that it is exported by export_data_service instead.
+    """
+    output_format = data.get("export_format", "csv")
+    options = json.loads(data.get("options", "{'table': true, 'stats': true}"))
+    if output_format not in ["csv", "txt"] or not options.get("table"):
+        return None
+    try:
+        request = DataRequest.from_args(data)
+    except Exception:
+        return None
+    if (
+        ("Equal" not in request.method and request.interval != "daily")
+        or ("None" not in request.statistics and options.get("stats"))
+        or request.spatial_scale in ["field", "unknown"]
+        or data_cache_key(request) in result_cache
+    ):
+        return None
+    # Repeats are copied from the artifact store by export_data_service
+    key = export_cache_key(data)
+    if key in artifact_store:
+        return None
 
+    try:
+        db_tables = [{"db": db, "table": table} for db, table in request.db_tables]
+        columns = list(request.columns) if request.columns != "All" else "All"
+        table_fetches = plan_table_fetches(
+            db_tables, columns, request.id_column, request.date_type
+        )
+        if isinstance(table_fetches, dict):
+            return table_fetches
+        if len(table_fetches) != 1:
+            return None
+        fetch = table_fetches[0]
+        table = fetch["table"]
+
+        # Integer columns with missing values turn to floats only in some chunks
+        db_path = safe_join(Config.PATHFILE, table["db"])
+        real_table_name, real_columns, ID = resolve_table_columns(
+            db_path, table["table"], fetch["fetch_columns"]
+        )
+        column_types = get_table_catalog(db_path, real_table_name)["column_types"]
+        if any(
+            column_affinity(column_types.get(col, "")) == "INTEGER"
+            for col in (real_columns if real_columns is not None else column_types)
+            if col != ID
+        ):
+            return None
+
+        chunks = iter_data_from_db(
+            table["db"],
+            table["table"],
+            list(request.ids),
+            fetch["fetch_columns"],
+            request.start_date,
+            request.end_date,
+            request.date_type,
+            Config.EXPORT_CHUNK_ROWS,
+        )
+
+        def process(chunk):
+            # The same steps as compute_data_frames and save_to_file, row by row
+            for col in fetch["duplicate_columns"]:
+                col_temp = col[len(table["table"]) + 1 :]
+                if col_temp in chunk.columns:
+                    chunk = chunk.rename(columns={col_temp: col})
+            if request.spatial_scale == "reach":
+                chunk = chunk[chunk[request.id_column] != 0]
+            formula_result = apply_math_formula(
+                chunk, request.math_formula, db_tables, request.id_column
+            )
+            if formula_result.get("error", None):
+                return formula_result
+            chunk = formula_result["df"]
+            if columns != "All":
+                chunk = chunk[columns]
+            chunk = round_numeric_frame(chunk)
+            if request.date_type:
+                chunk[request.date_type] = pd.to_datetime(
+                    chunk[request.date_type]
+                ).dt.date
+            return chunk
+
+        # Read the first chunk before responding so that errors are still returned as JSON
+        first = next(chunks, None)
+        if first is None or first.empty:
+            chunks.close()
+            return {"error": "No data found for the specified filters."}
+        first = process(first)
+        if isinstance(first, dict):
+            chunks.close()
+            return first
+
+        output_filename = data.get(
+            "export_filename",
+            f"exported_data_{datetime.now().strftime('%Y%m%d%H%M%S')}",
+        )
+        file_path = export_file_path(
+            data.get("export_path", "dataExport"), f"{output_filename}.{output_format}"
+        )
+    except Exception as e:
+        return {"error": str(e)}
+
+    def generate():
+        sep = "," if output_format == "csv" else " "
+        # Same newline handling as save_to_file, the response matches the file
+        newline = "" if output_format == "csv" else None
+        with closing(chunks), open(file_path, "w", newline=newline) as f:
+            chunk, header = first, True
+            while chunk is not None:
+                if isinstance(chunk, dict):
+                    raise ValueError(chunk["error"])
+                text = chunk.to_csv(index=False, header=header, sep=sep)
+                f.write(text)
+                if newline is None:
+                    text = text.replace("\n", os.linesep)
+                yield text.encode(f.encoding)
+                header = False
+                chunk = next(chunks, None)
+                chunk = process(chunk) if chunk is not None else None
+        # Only complete files are reused
+        artifact_store.put(key, file_path)
+
+    return {"stream": generate(), "file_path": file_path}
+
+
+def resolve_table_columns(db_path, table_name, columns):
+    """
+    Return the real name of an aliased table, the real columns to select (None for all
+    columns) and the ID column.
+    """
     # table_name is an alias so replace it with the real table name
     real_table_name = alias_mapping.get(table_name, {}).get("real", table_name)
 
     # If specific columns are selected, map them to the real columns
-    columns_list = []
     if columns != "All":
-        columns_list = columns
+        columns_list = list(columns)
         real_columns = [
-            f'"{alias_mapping.get(table_name, {}).get("columns", {}).get(col, col)}"'
+            alias_mapping.get(table_name, {}).get("columns", {}).get(col, col)
             for col in columns_list
         ]
-        columns = ",".join(real_columns)
     else:
-        columns_list = pd.read_sql_query(
-            f"PRAGMA table_info('{real_table_name}')", conn
-        )["name"].tolist()
-
-    # Start building the base query using real table name
-    query = f"SELECT {columns if columns != 'All' else '*'} FROM '{real_table_name}'"
-    params = []
+        columns_list = get_table_catalog(db_path, real_table_name)["columns"]
+        real_columns = None
 
     ID = next((col for col in columns_list if "ID" in col), "ID")
+    return real_table_name, real_columns, ID
 
-    # Add conditions for selected_ids
-    if selected_ids != []:
-        placeholders = ",".join(["?"] * len(selected_ids))
-        query += f" WHERE {ID} IN ({placeholders})"
-        params.extend(selected_ids)
 
-    # Add date range conditions
-    if start_date and end_date:
-        if selected_ids != []:
-            query += f" AND {date_type} BETWEEN ? AND ?"
-        else:
-            query += f" WHERE {date_type} BETWEEN ? AND ?"
-        params.extend([start_date, end_date])
-
-    # Execute the query with parameters
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-
-    # Map real column names back to alias if needed
-    alias_columns = [
+def alias_frame_columns(df, real_table_name, ID):
+    """Map real column names back to alias if needed."""
+    df.columns = [
         (
             alias_mapping.get(real_table_name, {}).get("columns", {}).get(col, col)
             if ID not in col
@@ -529,13 +1056,116 @@ def fetch_data_from_db(
         )
         for col in df.columns
     ]
-    df.columns = alias_columns
+    return df
+
+
+def fetch_data_from_db(
+    db_path,
+    table_name,
+    selected_ids,
+    columns,
+    start_date,
+    end_date,
+    date_type,
+    aggregation=None,
+):
+    """
+    Fetch data from a SQLite database table with real-to-alias mapping,
+    optionally summed per ID and interval period.
+    """
+    db_path = safe_join(Config.PATHFILE, db_path)
+    real_table_name, real_columns, ID = resolve_table_columns(
+        db_path, table_name, columns
+    )
+
+    # Read from the columnar mirror of the table, or from SQLite if it is stale or missing
+    df = (
+        read_mirror(
+            db_path,
+            real_table_name,
+            real_columns,
+            ID,
+            selected_ids,
+            date_type,
+            start_date,
+            end_date,
+        )
+        if not aggregation
+        else None
+    )
+    if df is None:
+        df = query_table(
+            db_path,
+            real_table_name,
+            real_columns,
+            ID,
+            selected_ids,
+            date_type,
+            start_date,
+            end_date,
+            aggregation,
+        )
+
+    return alias_frame_columns(df, real_table_name, ID)
+
+
+def iter_data_from_db(
+    db_path,
+    table_name,
+    selected_ids,
+    columns,
+    start_date,
+    end_date,
+    date_type,
+    chunk_size,
+):
+    """
+    Yield the rows of fetch_data_from_db in chunks read from the SQLite cursor.
+    Real columns are read as floats in every chunk, so a chunk of missing values
+    keeps the dtype the whole table would have.
+    """
+    db_path = safe_join(Config.PATHFILE, db_path)
+    real_table_name, real_columns, ID = resolve_table_columns(
+        db_path, table_name, columns
+    )
+    column_types = get_table_catalog(db_path, real_table_name)["column_types"]
+    dtype = {
+        col: "float64"
+        for col in (real_columns if real_columns is not None else column_types)
+        if column_affinity(column_types.get(col, "")) == "REAL"
+    }
+
+    for chunk in iter_table(
+        db_path,
+        real_table_name,
+        real_columns,
+        ID,
+        selected_ids,
+        date_type,
+        start_date,
+        end_date,
+        chunk_size,
+        dtype,
+    ):
+        yield alias_frame_columns(chunk, real_table_name, ID)
 
-    return df.map(round_numeric_values)
 
 def is_running_as_pyinstaller():
     return getattr(sys, "frozen", False) and hasattr(sys, "_MEIPASS")
 
+
+def export_file_path(export_path, filename):
+    """Path of an export file, creating its folder."""
+    file_path = (
+        safe_join(Config.PATHFILE_EXPORT, export_path)
+        if not os.path.isabs(export_path) or os.environ.get("WAITRESS") == "1" or not is_running_as_pyinstaller()
+        else export_path
+    )
+
+    os.makedirs(file_path, exist_ok=True)
+    return safe_join(file_path, filename)
+
+
 # Helper function to save data to CSV or text formats
 def save_to_file(
     dataframe1,
@@ -546,24 +1176,18 @@ def save_to_file(
     options,
     date_type,
     multi_graph_type,
-    geojson_data,
+    layer,
     feature,
     feature_statistic,
     spatial_scale,
     default_crs,
     selected_ids=[],
     is_empty=False,
+    report=None,
 ):
     """Save two DataFrames to the specified file format sequentially."""
     # Set the file path
-    file_path = (
-        safe_join(Config.PATHFILE_EXPORT, export_path)
-        if not os.path.isabs(export_path) or os.environ.get("WAITRESS") == "1" or not is_running_as_pyinstaller()
-        else export_path
-    )
-
-    os.makedirs(file_path, exist_ok=True)
-    file_path = safe_join(file_path, filename)
+    file_path = export_file_path(export_path, filename)
 
     # Map graph types to Matplotlib Axes methods
     GRAPH_TYPE_MAPPING = {
@@ -577,6 +1201,8 @@ def save_to_file(
     if not is_empty and date_type:
         # Check if the dataframe contains an ID column
         ID = next((col for col in dataframe1.columns if "ID" in col), "ID")
+        # Shallow copy, the shared frame keeps its dates
+        dataframe1 = dataframe1.copy(deep=False)
         dataframe1[date_type] = pd.to_datetime(dataframe1[date_type]).dt.date
 
         # Keep track of which axis (primary or secondary) to use for each column
@@ -609,208 +1235,44 @@ def save_to_file(
                 f.write("\n")
                 dataframe2.to_csv(f, index=False, sep=" ")
     elif file_format == "xlsx":
-        # Write the DataFrame to an Excel file
-        with pd.ExcelWriter(file_path, engine="xlsxwriter") as writer:
-            date_type_list = [date_type] if date_type else []
-            cols_to_front = [*date_type_list, ID] + [
-                col for col in dataframe1.columns if col not in [ID, *date_type_list]
-            ]
-            dataframe1 = dataframe1[cols_to_front]
-            # Sort dataframe by ID column for consistent selection
-            dataframe1 = dataframe1.sort_values([ID, *date_type_list])
-            # Write the DataFrame to Excel
-            dataframe1.to_excel(writer, sheet_name="Sheet1", index=False)
-
-            # Access the workbook and worksheet objects
-            workbook = writer.book
-            worksheet = writer.sheets["Sheet1"]
-
-            # Initialize the chart object
-            chart = None
-
-            # Define chart type and add data for the chart
-            for i, column_graph in enumerate(multi_graph_type, start=1):
-                multi_graph_type_same = (
-                    i > 1 and multi_graph_type[i - 2]["type"] == column_graph["type"]
-                )
-                overlay_chart = (
-                    chart
-                    if multi_graph_type_same
-                    else workbook.add_chart(
-                        {
-                            "type": GRAPH_TYPE_MAPPING.get(
-                                column_graph["type"] + "x", column_graph["type"]
-                            )
-                        }
-                    )
-                )
-                column = column_graph["name"]
-                row_count = len(dataframe1) + 1
-
-                if selected_ids and selected_ids != []:
-                    prev_end_row = 1  # Start from the first data row
-
-                    for j, selected_id in enumerate(selected_ids):
-                        # Calculate the start and end rows for the current ID
-                        start_row = prev_end_row + 1
-                        end_row = (
-                            start_row
-                            + len(dataframe1[dataframe1[ID] == selected_id])
-                            - 1
-                        )
-                        col_letter = xl_col_to_name(i + 1)
-
-                        # Add a series to the overlay chart
-                        overlay_chart.add_series(
-                            {
-                                "name": f"{column} - {ID}: {selected_id}",
-                                "categories": f"Sheet1!$A${start_row}:$A${end_row}",  # Assuming column A contains categories
-                                "values": f"Sheet1!${col_letter}${start_row}:${col_letter}${end_row}",
-                                "y2_axis": column
-                                in secondary_axis_columns,  # Assign to secondary y-axis if applicable
-                            }
-                        )
-
-                        # Update previous end row
-                        prev_end_row = end_row
-
-                else:
-                    col_letter = xl_col_to_name(i + 1) if ID else xl_col_to_name(i)
-                    # Add a single series for each selected column when selected_ids is empty
-                    overlay_chart.add_series(
-                        {
-                            "name": column,
-                            "categories": f"Sheet1!$A$2:$A${row_count}",
-                            "values": f"Sheet1!${col_letter}$2:${col_letter}${row_count}",
-                            "y2_axis": column in secondary_axis_columns,
-                        }
-                    )
-                if chart is None or multi_graph_type_same:
-                    chart = overlay_chart
-                else:
-                    chart.combine(overlay_chart)
-            if not primary_axis_columns or (
-                ID in primary_axis_columns and len(primary_axis_columns) == 1
-            ):
-                # Add dummy series to primary y-axis if no columns are present
-                chart.add_series(
-                    {
-                        "name": "Dummy",
-                        "categories": f"Sheet1!$A$2:$A${row_count}",
-                        "values": f"Sheet1!$B$2:$B${row_count}",
-                        "y2_axis": False,
-                    }
-                )
-
-            # Customize the chart
-            chart.set_x_axis(
-                {
-                    "name": date_type,
-                    "date_axis": True,
-                    "num_format": "yyyy-mm-dd",
-                    "major_gridlines": {"visible": True},
-                    "num_font": {"rotation": -45},
-                    "visible": True,
-                }
-            )
-            primary_y_axis_options = {
-                "name": "Values (Smaller Values)",
-                "major_gridlines": {"visible": len(primary_axis_columns) > 1},
-            }
-            chart.set_y_axis(primary_y_axis_options)
-
-            # Configure the secondary Y axis only if it's actually needed
-            if secondary_axis_columns:
-                chart.set_y2_axis(
-                    {
-                        "name": "Values (Larger Values)",
-                        "major_gridlines": {"visible": True},
-                    }
-                )
-
-            # Insert the chart into the worksheet
-            worksheet.insert_chart(
-                f"{xl_col_to_name(len(dataframe1.columns) + 1)}2", chart
-            )
-            workbook.close()
+        save_to_xlsx(
+            file_path,
+            dataframe1,
+            ID,
+            date_type,
+            multi_graph_type,
+            selected_ids,
+            primary_axis_columns,
+            secondary_axis_columns,
+            GRAPH_TYPE_MAPPING,
+        )
+    elif file_format in ["png", "jpg", "jpeg", "svg", "pdf"] and report == "per_id":
+        # Multi-page pdf with the chart of each ID on its own page
+        save_report(
+            file_path,
+            dataframe1,
+            date_type,
+            ID,
+            multi_graph_type,
+            selected_ids,
+            primary_axis_columns,
+            secondary_axis_columns,
+        )
     elif file_format in ["png", "jpg", "jpeg", "svg", "pdf"]:
         # Plot each column as a line on the same figure
-        fig, ax1 = plt.subplots(figsize=(10, 6))
-        ax2 = ax1.twinx()  # Create a secondary y-axis
-        # Setting color cycles
-        ax1.set_prop_cycle(cycler(color=plt.cm.tab10.colors))
-        # Check if ax2 will have plots
-        ax2_has_data = any(
-            column_graph["name"] in secondary_axis_columns
-            for column_graph in multi_graph_type
+        save_chart(
+            file_path,
+            file_format,
+            dataframe1,
+            date_type,
+            ID,
+            multi_graph_type,
+            selected_ids,
+            primary_axis_columns,
+            secondary_axis_columns,
         )
-        if ax2_has_data:
-            ax2.set_prop_cycle(cycler(color=plt.cm.Set2.colors))
-
-        for i, column_graph in enumerate(multi_graph_type):
-            column = column_graph["name"]
-            if dataframe1[column].dtype == "object":
-                continue
-            plot_func = getattr(
-                ax1 if column in primary_axis_columns else ax2,
-                GRAPH_TYPE_MAPPING[column_graph["type"]],
-            )
-
-            if selected_ids and selected_ids != []:
-                # Create separate plots for each ID-Column combination
-                for j, selected_id in enumerate(selected_ids):
-                    filtered_data = dataframe1[dataframe1[ID] == selected_id]
-                    plot_func(
-                        (
-                            filtered_data[date_type] + pd.DateOffset((i + j) * 2)
-                            if column_graph["type"] == "bar"
-                            else filtered_data[date_type]
-                        ),
-                        filtered_data[column],
-                        label=f"{column} - {ID}: {selected_id}",
-                        alpha=0.7,
-                    )
-            else:
-                # Plot each column as a single series if selected_ids is empty
-                plot_func(
-                    (
-                        dataframe1[date_type] + pd.DateOffset(i * 2)
-                        if column_graph["type"] == "bar"
-                        else dataframe1[date_type]
-                    ),
-                    dataframe1[column],
-                    label=column,
-                    alpha=0.7,
-                )
-
-        # Customize axes
-        ax1.set_xlabel(date_type)
-        ax1.set_ylabel("Values (Smaller Values)")
-        ax1.yaxis.set_major_locator(LinearLocator(numticks=8))
-        ax1.grid(visible=True, linestyle="--", alpha=0.6)
-
-        if ax2_has_data:
-            ax2.set_ylabel("Values (Larger Values)")
-            # Ensure same number of y-axis ticks on both axes
-            ax2.yaxis.set_major_locator(LinearLocator(numticks=8))
-            ax2.grid(visible=True, linestyle="--", alpha=0.6)
-
-        ax1.legend(loc="upper left")
-        if ax2_has_data:
-            ax2.legend(loc="upper right")
-
-        # Rotate x-axis labels (explicitly for ax1 and ax2 if shared x-axis is used)
-        for tick in ax1.get_xticklabels():
-            tick.set_rotation(45)
-
-        # Adjust layout to avoid label overlap
-        plt.tight_layout()
-
-        # Save the plot
-        plt.savefig(file_path, format=file_format)
-    elif file_format == "shp":
-        # Load the GeoJSON dictionary into a GeoDataFrame
-        gdf = gpd.GeoDataFrame.from_features(geojson_data["features"])
+    elif file_format in GEOSPATIAL_FORMATS:
+        gdf = layer
 
         geometry_types = [
             "Point",
@@ -885,40 +1347,265 @@ def save_to_file(
             if not gdf_geom.empty
         ]
 
-        # Save the GeoDataFrames to Shapefiles and create a zip file
-        save_data_and_create_zip(geometry_and_suffixes, base_filename, file_path)
-
-        file_path = f"{base_filename}.zip"
+        if file_format == "shp":
+            # Save the GeoDataFrames to Shapefiles and create a zip file
+            file_path = save_data_and_create_zip(geometry_and_suffixes, base_filename)
+        elif file_format == "gpkg":
+            # One GeoPackage with a layer per geometry type
+            save_geopackage(geometry_and_suffixes, file_path)
+        else:
+            # FlatGeobuf files hold a single layer, with all geometry types
+            save_layer_file(
+                merged_gdf.dropna(how="all", axis=1), file_path, "FlatGeobuf"
+            )
 
     return file_path
 
 
+def xlsx_sheet_ranges(positions, sheet_rows):
+    """
+    Split a range of sorted row positions (start, end inclusive) into the
+    (sheet index, first row, last row) parts of each sheet, as 1-based Excel rows below
+    the header.
+    """
+    start, end = positions
+    parts = []
+    while start <= end:
+        sheet = start // sheet_rows
+        last = min(end, (sheet + 1) * sheet_rows - 1)
+        parts.append((sheet, start % sheet_rows + 2, last % sheet_rows + 2))
+        start = last + 1
+    return parts
+
+
+def save_to_xlsx(
+    file_path,
+    dataframe1,
+    ID,
+    date_type,
+    multi_graph_type,
+    selected_ids,
+    primary_axis_columns,
+    secondary_axis_columns,
+    graph_type_mapping,
+):
+    """
+    Write a DataFrame sorted by ID and date to an Excel file with a chart of the selected
+    columns. The workbook is written in constant memory mode, row by row in chunks of
+    XLSX_CHUNK_ROWS rows, and continues on a new sheet when a sheet is full.
+    """
+    date_type_list = [date_type] if date_type else []
+    columns = [*date_type_list, ID] + [
+        col for col in dataframe1.columns if col not in [ID, *date_type_list]
+    ]
+    # Sort the row positions only, the rows are taken chunk by chunk while writing
+    keys = dataframe1[[ID, *date_type_list]].reset_index(drop=True)
+    order = keys.sort_values([ID, *date_type_list]).index.to_numpy()
+    sorted_ids = keys[ID].to_numpy()[order]
+
+    workbook = xlsxwriter.Workbook(
+        file_path, {"constant_memory": True, "nan_inf_to_errors": True}
+    )
+    header_format = workbook.add_format(
+        {"bold": True, "border": 1, "align": "center", "valign": "top"}
+    )
+    date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+    sheet_rows = EXCEL_MAX_ROWS - 1  # Data rows per sheet below the header
+    sheets = []
+
+    def add_sheet():
+        sheet = workbook.add_worksheet(f"Sheet{len(sheets) + 1}")
+        if date_type:
+            # Dates are written as Excel serial numbers shown with the column format
+            sheet.set_column(0, 0, None, date_format)
+        sheet.write_row(0, 0, columns, header_format)
+        sheets.append(sheet)
+
+    for start in range(0, max(len(order), 1), XLSX_CHUNK_ROWS):
+        report_progress(0.3 + 0.6 * start / max(len(order), 1), "Writing rows")
+        chunk = dataframe1.iloc[order[start : start + XLSX_CHUNK_ROWS]][columns]
+        if date_type:
+            days = (
+                pd.to_datetime(chunk[date_type]) - pd.Timestamp("1899-12-30")
+            ).dt.days
+            # Excel counts the 29th of February 1900, so earlier dates are a day less
+            chunk = chunk.assign(**{date_type: days.where(days > 60, days - 1)})
+        # Missing values are left as empty cells
+        rows = chunk.astype(object).where(chunk.notna(), None)
+        for position, row in enumerate(rows.itertuples(index=False, name=None), start):
+            if position % sheet_rows == 0:
+                add_sheet()
+            sheets[-1].write_row(position % sheet_rows + 1, 0, row)
+    if not sheets:
+        add_sheet()
+
+    # Rows of each ID, which are contiguous once sorted
+    id_rows = {}
+    if len(sorted_ids):
+        boundaries = np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1
+        starts = np.r_[0, boundaries]
+        ends = np.r_[boundaries, len(sorted_ids)] - 1
+        id_rows = dict(zip(sorted_ids[starts].tolist(), zip(starts, ends)))
+
+    def add_series(chart, name, col_letter, positions, y2_axis):
+        # Series can not span sheets, so a range split over sheets adds one per sheet
+        parts = xlsx_sheet_ranges(positions, sheet_rows)
+        for sheet, first_row, last_row in parts:
+            sheet_name = sheets[sheet].get_name()
+            chart.add_series(
+                {
+                    "name": name if len(parts) == 1 else f"{name} ({sheet_name})",
+                    "categories": f"{sheet_name}!$A${first_row}:$A${last_row}",
+                    "values": f"{sheet_name}!${col_letter}${first_row}:${col_letter}${last_row}",
+                    "y2_axis": y2_axis,
+                }
+            )
+
+    # Initialize the chart object
+    chart = None
+    all_rows = (0, len(order) - 1)
+
+    # Define chart type and add data for the chart
+    for i, column_graph in enumerate(multi_graph_type, start=1):
+        multi_graph_type_same = (
+            i > 1 and multi_graph_type[i - 2]["type"] == column_graph["type"]
+        )
+        overlay_chart = (
+            chart
+            if multi_graph_type_same
+            else workbook.add_chart(
+                {
+                    "type": graph_type_mapping.get(
+                        column_graph["type"] + "x", column_graph["type"]
+                    )
+                }
+            )
+        )
+        column = column_graph["name"]
+        if column not in columns:
+            continue
+        col_letter = xl_col_to_name(columns.index(column))
+        y2_axis = column in secondary_axis_columns
+
+        if selected_ids and selected_ids != []:
+            # One series per selected ID with data
+            for selected_id in selected_ids:
+                if selected_id in id_rows:
+                    add_series(
+                        overlay_chart,
+                        f"{column} - {ID}: {selected_id}",
+                        col_letter,
+                        id_rows[selected_id],
+                        y2_axis,
+                    )
+        else:
+            # Add a single series for each selected column when selected_ids is empty
+            add_series(overlay_chart, column, col_letter, all_rows, y2_axis)
+        if chart is None or multi_graph_type_same:
+            chart = overlay_chart
+        else:
+            chart.combine(overlay_chart)
+
+    if chart is not None:
+        if not primary_axis_columns or (
+            ID in primary_axis_columns and len(primary_axis_columns) == 1
+        ):
+            # Add dummy series to primary y-axis if no columns are present
+            add_series(chart, "Dummy", "B", all_rows, False)
+
+        # Customize the chart
+        chart.set_x_axis(
+            {
+                "name": date_type,
+                "date_axis": True,
+                "num_format": "yyyy-mm-dd",
+                "major_gridlines": {"visible": True},
+                "num_font": {"rotation": -45},
+                "visible": True,
+            }
+        )
+        primary_y_axis_options = {
+            "name": "Values (Smaller Values)",
+            "major_gridlines": {"visible": len(primary_axis_columns) > 1},
+        }
+        chart.set_y_axis(primary_y_axis_options)
+
+        # Configure the secondary Y axis only if it's actually needed
+        if secondary_axis_columns:
+            chart.set_y2_axis(
+                {
+                    "name": "Values (Larger Values)",
+                    "major_gridlines": {"visible": True},
+                }
+            )
+
+        # Insert the chart into the first worksheet
+        sheets[0].insert_chart(f"{xl_col_to_name(len(columns) + 1)}2", chart)
+    workbook.close()
+
+
 def save_geospatial_data(gdf_geom, suffix, base_filename):
     """Function to save geospatial data (e.g., Shapefiles)."""
     gdf_geom.to_file(f"{base_filename}{suffix}.shp", driver="ESRI Shapefile")
 
 
-def save_data_and_create_zip(geometry_and_suffixes, base_filename, file_path):
-    # First thread pool for saving geospatial data
-    with ThreadPoolExecutor() as executor:
-        # Unpack the geometry and suffixes and save the geospatial data
-        executor.map(
-            lambda args: save_geospatial_data(*args, base_filename),
-            geometry_and_suffixes,
-        )
+def save_data_and_create_zip(geometry_and_suffixes, base_filename):
+    """
+    Write a Shapefile per geometry type to a scratch folder of this export, in parallel,
+    and zip only their files to {base_filename}.zip. Returns the path of the zip file.
+    """
+    name = os.path.basename(base_filename)
+    scratch_dir = tempfile.mkdtemp(prefix="shp_", dir=Config.TEMPDIR)
+    try:
+        scratch_base = os.path.join(scratch_dir, name)
+        with ThreadPoolExecutor() as executor:
+            # Consume the results so that errors of the writers are raised
+            list(
+                executor.map(
+                    lambda args: save_geospatial_data(*args, scratch_base),
+                    geometry_and_suffixes,
+                )
+            )
+
+        # Geometries and their index barely compress, so they are stored as they are
+        zip_path = f"{base_filename}.zip"
+        temp_path = os.path.join(scratch_dir, f"{name}.zip")
+        with ZipFile(temp_path, "w", compression=ZIP_DEFLATED) as zipf:
+            for file in sorted(os.listdir(scratch_dir)):
+                if file.endswith(".zip"):
+                    continue
+                compression = (
+                    ZIP_STORED if file.endswith((".shp", ".shx")) else ZIP_DEFLATED
+                )
+                zipf.write(
+                    os.path.join(scratch_dir, file), file, compress_type=compression
+                )
+        shutil.move(temp_path, zip_path)
+        return zip_path
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
 
-    # Create the zip file sequentially
-    file_paths = []
-    for root, _, files in os.walk(os.path.dirname(file_path)):
-        for file in files:
-            if not file.endswith(".zip"):
-                file_paths.append(os.path.join(root, file))
 
-    # Now zip the files
-    with ZipFile(f"{base_filename}.zip", "w", compression=ZIP_DEFLATED) as zipf:
-        for file_path in file_paths:
-            arcname = os.path.relpath(file_path, os.path.dirname(file_path))
-            zipf.write(file_path, arcname)
+def save_layer_file(gdf, file_path, driver, layer=None, append=False):
+    """Write a layer to a single file GeoPackage or FlatGeobuf."""
+    gdf.to_file(file_path, driver=driver, layer=layer, append=append)
+
+
+def save_geopackage(geometry_and_suffixes, file_path):
+    """
+    Write a GeoPackage with a layer per geometry type. It is written next to the export
+    and moved into place, so a failed export does not leave a partial file.
+    """
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    temp_path = f"{file_path}.{threading.get_ident()}.tmp.gpkg"
+    try:
+        # SQLite has a single writer, so the layers are written one after the other
+        for i, (gdf_geom, suffix) in enumerate(geometry_and_suffixes):
+            save_layer_file(gdf_geom, temp_path, "GPKG", f"{name}{suffix}", i > 0)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
 
 def get_table_names(data):
@@ -927,10 +1614,10 @@ def get_table_names(data):
     """
     try:
         db_path = data.get("db_path")
-        conn = sqlite3.connect(safe_join(Config.PATHFILE, db_path))
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+        with get_connection(safe_join(Config.PATHFILE, db_path)) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+            tables = cursor.fetchall()
         # Map real table names to alias names
         alias_tables = [
             alias_mapping.get(table[0], {}).get("alias", table[0]) for table in tables
@@ -938,8 +1625,6 @@ def get_table_names(data):
         return {"tables": alias_tables}
     except Exception as e:
         return {"error": str(e)}
-    finally:
-        conn.close()
 
 
 def get_files_and_folders(data):
@@ -1074,7 +1759,10 @@ def aggregate_data(df, interval, method, date_type, month, season):
             [ID, "Season", pd.Grouper(key=date_type, freq="QS-DEC")]
         ).sum(numeric_only=True)
         if season:
-            resampled_df = resampled_df[resampled_df["Season"] == season.title()]
+            resampled_df = resampled_df[
+                resampled_df.index.get_level_values("Season")
+                == SEASON_NAMES.get(season, season.title())
+            ]
     else:
         resampled_df = df
 
@@ -1092,7 +1780,7 @@ def aggregate_data(df, interval, method, date_type, month, season):
         resampled_df[date_type] = resampled_df[date_type].dt.strftime("%Y-%m-%d")
     stats_df = calculate_statistics(resampled_df, method, date_type)
 
-    return resampled_df.map(round_numeric_values), stats_df.map(round_numeric_values)
+    return resampled_df, stats_df
 
 
 def round_numeric_values(value):
@@ -1108,6 +1796,76 @@ def round_numeric_values(value):
     return value
 
 
+def _exact_nearest(values, scale, product, nearest):
+    """
+    Correct the rounded products of values whose product with scale is halfway between
+    integers or above 2**52, where rounding the product itself can pick the wrong side.
+    """
+    # Dekker's exact product: product + error == values * scale
+    split = 134217729.0 * values  # 2**27 + 1
+    high = split - (split - values)
+    low = values - high
+    error = (high * scale - product) + low * scale
+
+    offset = product - nearest
+    # Past a halfway product, the error tells on which side the exact value is
+    nearest = np.where(
+        (np.abs(offset) == 0.5) & (error != 0),
+        np.where(error > 0, np.ceil(product), np.floor(product)),
+        nearest,
+    )
+    # Integer products above 2**52 can have an exact tie in their error
+    return np.where(
+        (offset == 0) & (np.abs(error) == 0.5) & (nearest % 2 == 1),
+        nearest + np.sign(error),
+        nearest,
+    )
+
+
+def round_float_array(values):
+    """
+    Vectorised round_numeric_values for an array of floats, with the same results as
+    round(): halfway cases are decided on the exact binary value like Python does.
+    """
+    values = np.asarray(values, dtype=float)
+    with np.errstate(over="ignore", invalid="ignore"):
+        scale = np.where(np.abs(values) < 0.01, 10000.0, 100.0)
+        product = values * scale
+        nearest = np.rint(product)
+        check = np.flatnonzero(
+            (np.abs(product - nearest) == 0.5) | (np.abs(product) >= 2.0**52)
+        )
+        if len(check):
+            nearest[check] = _exact_nearest(
+                values[check], scale[check], product[check], nearest[check]
+            )
+        rounded = nearest / scale
+    # Larger values are already closer to the rounded value than to any other double
+    return np.where(np.abs(product) < 2.0**53, rounded, values)
+
+
+def round_numeric_frame(df):
+    """
+    Apply round_numeric_values to a DataFrame: float columns are rounded as whole arrays,
+    only object columns, such as the statistics, are rounded value by value.
+    """
+    df = df.copy(deep=False)
+    for i, dtype in enumerate(df.dtypes):
+        if pd.api.types.is_float_dtype(dtype):
+            column = df.iloc[:, i]
+            df.isetitem(
+                i,
+                pd.Series(
+                    round_float_array(column.to_numpy(dtype=float, na_value=np.nan)),
+                    index=column.index,
+                    dtype=dtype,
+                ),
+            )
+        elif dtype == object:
+            df.isetitem(i, df.iloc[:, i].map(round_numeric_values))
+    return df
+
+
 def calculate_statistics(df, statistics, date_type):
     """Calculate specified statistics for numerical data in the DataFrame."""
     stats_df = pd.DataFrame()
@@ -1166,12 +1924,11 @@ def calculate_statistics(df, statistics, date_type):
     stats_df.reset_index(inplace=True)
     stats_df.rename(columns={"index": "Statistics"}, inplace=True)
 
-    return stats_df.map(round_numeric_values)
+    return stats_df
 
 
 def load_alias_mapping(folder_tree):
     """Load alias mapping from the lookup.db3 database."""
-    conn = sqlite3.connect(os.path.join(Config.PATHFILE, Config.LOOKUP))
     alias_map = {}
 
     # Query the alias tables (Hydroclimate, BMP, scenario_2)
@@ -1180,7 +1937,8 @@ def load_alias_mapping(folder_tree):
         table = os.path.basename(table).replace(".db3", "")
 
         query = f"SELECT * FROM '{table}'"
-        df = pd.read_sql_query(query, conn)
+        with get_connection(os.path.join(Config.PATHFILE, Config.LOOKUP)) as conn:
+            df = pd.read_sql_query(query, conn)
 
         for _, row in df.iterrows():
             real_table = row["Table Name"]
@@ -1194,7 +1952,6 @@ def load_alias_mapping(folder_tree):
             alias_map.setdefault(alias_table, {}).setdefault("real", real_table)
             alias_map[alias_table].setdefault("columns", {})[alias_column] = real_column
 
-    conn.close()
     return alias_map
 
 
@@ -1205,68 +1962,27 @@ def get_columns_and_time_range(db_path, table_name):
         # Convert the table alias to its real name if necessary
         real_table_name = alias_mapping.get(table_name, {}).get("real", table_name)
 
-        # Connect to the database
-        conn = sqlite3.connect(safe_join(Config.PATHFILE, db_path))
-
-        # Fetch column information using PRAGMA for the real table name
-        query = f"PRAGMA table_info('{real_table_name}')"
-        cursor = conn.cursor()
-        cursor.execute(query)
-        columns = [row[1] for row in cursor.fetchall()]
+        # Columns, date range and IDs come from the persistent table catalog
+        entry = get_table_catalog(safe_join(Config.PATHFILE, db_path), real_table_name)
 
         # Convert real column names to alias names (if available in the mapping)
         alias_columns = [
             alias_mapping.get(real_table_name, {}).get("columns", {}).get(col, col)
-            for col in columns
+            for col in entry["columns"]
         ]
 
-        # Initialize variables
-        start_date = end_date = date_type = interval = None
-
-        # Check and query for specific date/time columns (using real column names)
-        for date_col, dtype, inter in [
-            ("Time", "Time", "daily"),
-            ("Date", "Date", "daily"),
-            ("Month", "Month", "monthly"),
-            ("Year", "Year", "yearly"),
-        ]:
-            if date_col in columns:
-                df = pd.read_sql_query(
-                    f"SELECT {date_col} FROM '{real_table_name}'", conn
-                )
-                if date_col in ["Time", "Date"]:
-                    df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
-                    start_date = df[date_col].min().strftime("%Y-%m-%d")
-                    end_date = df[date_col].max().strftime("%Y-%m-%d")
-                elif date_col in ["Month", "Year"]:
-                    start_date = int(df[date_col].min())
-                    end_date = int(df[date_col].max())
-                date_type = dtype
-                interval = inter
-                break
-
-        # Get list of IDs if an ID column exists, without querying unnecessary data
-        id_column = next((col for col in columns if "ID" in col), None)
-        ids = []
-        if id_column:
-            id_query = f"SELECT DISTINCT {id_column} FROM '{real_table_name}'"
-            id_df = pd.read_sql_query(id_query, conn)
-            ids = id_df[id_column].tolist()
-
         # Return alias column names instead of real ones
         return {
             "columns": alias_columns,
-            "start_date": start_date,
-            "end_date": end_date,
-            "id_column": id_column or "",
-            "ids": ids,
-            "date_type": date_type,
-            "interval": interval,
+            "start_date": entry["start_date"],
+            "end_date": entry["end_date"],
+            "id_column": entry["id_column"] or "",
+            "ids": entry["ids"],
+            "date_type": entry["date_type"],
+            "interval": entry["interval"],
         }
     except Exception as e:
         return {"error": str(e)}
-    finally:
-        conn.close()
 
 
 def get_multi_columns_and_time_range(data):
@@ -1677,24 +2393,24 @@ def get_colormap_name(feature):
 
 def fetch_geojson_colors(data):
     """
-    Fetches data from `fetch_data_service`, applies feature statistics, and generates geojson color mapping.
+    Fetches data from `fetch_data_frames`, applies feature statistics, and generates geojson color mapping.
     """
-    # Step 1: Fetch raw data
-    output = fetch_data_service(data)
-    new_feature = output.get("new_feature", None)
+    # Step 1: Fetch raw data, shared with get_data through the result cache
+    output = fetch_data_frames(data)
+    new_feature = output.new_feature if isinstance(output, DataResult) else None
     feature = new_feature or data.get("feature", "value")
     feature_statistic = data.get("feature_statistic", "mean")
 
     if not feature or feature == "value":
         return {}
 
-    if output.get("error", None):
+    if isinstance(output, dict):
         return output
 
-    if "data" not in output:
+    if output.df is None:
         return {"error": "No data found"}
 
-    df = pd.DataFrame(output["data"])
+    df = output.df
     ID = next((col for col in df.columns if "ID" in col), None)
 
     if ID is None:
@@ -1747,9 +2463,12 @@ def fetch_geojson_colors(data):
     ]
 
     # Step 6: Assign Colors to Each ID Based on Their Bin
+    # Rows share one dtype like iterrows did, so numeric IDs stay keyed as floats
     geojson_colors = {
-        row[ID]: [dynamic_colors[int(row["color_class"])], row["color_class"] + 2]
-        for _, row in feature_df.iterrows()
+        feature_id: [dynamic_colors[int(color_class)], color_class + 2]
+        for feature_id, _, color_class in feature_df[
+            [ID, feature, "color_class"]
+        ].to_numpy().tolist()
     }
 
     return {
@@ -1759,6 +2478,72 @@ def fetch_geojson_colors(data):
     }
 
 
+def geospatial_artifact_name(data):
+    """
+    Name of the stored /api/geospatial response of the selected files, which changes with
+    the size and mtime of the files and of the sidecar files of shapefiles.
+    """
+    file_paths = [
+        safe_join(Config.PATHFILE, path) for path in json.loads(data.get("file_paths"))
+    ]
+    sources = [source for path in file_paths for source in geospatial_sources(path)]
+    return "geospatial_" + make_key({"file_paths": file_paths}, sources)
+
+
+def geospatial_sources(file_path):
+    """Files read for a selected file: a shapefile with its sidecar files, or the file."""
+    if not file_path:
+        return []
+    if file_path.endswith(".shp"):
+        stem = file_path[: -len(".shp")]
+        return [stem + ext for ext in [".shp", ".shx", ".dbf", ".prj", ".cpg"]]
+    return [file_path]
+
+
+def geospatial_layer_name(file_path):
+    """
+    Name of the reprojected layer of a shapefile in TEMPDIR, which changes with its full
+    path and with the size and mtime of its files, so same-named shapefiles don't collide.
+    """
+    key = make_key({"file_path": file_path}, geospatial_sources(file_path))
+    return "layer_" + key + GEOSPATIAL_LAYER_SUFFIX
+
+
+def geospatial_layer_paths(layer_handles):
+    """
+    Paths of the reprojected layers stored in TEMPDIR by process_geospatial_data for their
+    layer handles, or None if a handle is invalid or its layer was removed.
+    """
+    layer_paths = [safe_join(Config.TEMPDIR, handle) for handle in layer_handles]
+    if not all(
+        path and path.endswith(GEOSPATIAL_LAYER_SUFFIX) and os.path.isfile(path)
+        for path in layer_paths
+    ):
+        return None
+    return layer_paths
+
+
+def load_export_layer(data):
+    """
+    Map layer of an export as a GeoDataFrame, read from the layers stored for its
+    layer_handles, or from the GeoJSON uploaded as geojson_data by older clients.
+    """
+    layer_handles = json.loads(data.get("layer_handles") or "[]")
+    if not layer_handles:
+        geojson_data = json.loads(data.get("geojson_data", "{}"))
+        return gpd.GeoDataFrame.from_features(geojson_data["features"])
+
+    layer_paths = geospatial_layer_paths(layer_handles)
+    if layer_paths is None:
+        return {"error": "The map layers are no longer available, reload the map."}
+    gdf = pd.concat([gpd.read_file(path) for path in layer_paths], ignore_index=True)
+    # GDAL reads GeoJSON integers as int32, widen them like the uploaded GeoJSON
+    gdf = gdf.astype({col: "int64" for col in gdf.select_dtypes("int32").columns})
+    # Features in the order of the map GeoJSON, sorted by geometry type
+    order = gdf.geom_type.map(GEOMETRY_ORDER).fillna(float("inf")).to_numpy()
+    return gdf.iloc[np.argsort(order, kind="stable")].reset_index(drop=True)
+
+
 def process_geospatial_data(data):
     """
     Process a geospatial file (shapefile or raster) and return GeoJSON/Tiff Image Url, bounds, and center.
@@ -1773,6 +2558,7 @@ def process_geospatial_data(data):
     combined_properties = []
     tool_tip = {}
     image_urls = []
+    layer_handles = []
     default_crs = None
 
     for file_path in file_paths:
@@ -1885,9 +2671,7 @@ def process_geospatial_data(data):
                 "field_names": properties,
             }
             geojson_metadata = {}
-            geojson_path = os.path.join(
-                Config.TEMPDIR, os.path.basename(file_path) + "_output.geojson"
-            )
+            geojson_path = os.path.join(Config.TEMPDIR, geospatial_layer_name(file_path))
 
             # Check if a GeoJSON file already exists and extract metadata
             if os.path.exists(geojson_path):
@@ -1897,13 +2681,24 @@ def process_geospatial_data(data):
                 # Convert reprojected layer to GeoJSON
                 geojson_driver = ogr.GetDriverByName("GeoJSON")
 
-                geojson_dataset = geojson_driver.CreateDataSource(geojson_path)
-                geojson_dataset.CopyLayer(
-                    reprojected_layer,
-                    "layer",
-                    ["RFC7946=YES", "WRITE_BBOX=YES"],
+                # Write to a temporary file and move it into place, so that a
+                # concurrent request never reads a partly written layer
+                tmp_path = (
+                    geojson_path[: -len(".geojson")]
+                    + f".{os.getpid()}.{threading.get_ident()}.tmp.geojson"
                 )
-                geojson_dataset = None
+                try:
+                    geojson_dataset = geojson_driver.CreateDataSource(tmp_path)
+                    geojson_dataset.CopyLayer(
+                        reprojected_layer,
+                        "layer",
+                        ["RFC7946=YES", "WRITE_BBOX=YES"],
+                    )
+                    geojson_dataset = None
+                    os.replace(tmp_path, geojson_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
 
             with open(geojson_path, "r") as file:
                 geojson_data = json.load(file)
@@ -1931,6 +2726,7 @@ def process_geospatial_data(data):
                     combined_properties.extend(properties)
                 else:
                     combined_properties = properties
+                layer_handles.append(os.path.basename(geojson_path))
 
             # Save properties for each shapefile path
             tool_tip[toolTipKey] = properties
@@ -2037,15 +2833,8 @@ def process_geospatial_data(data):
     # Define a function to get a sorting key based on geometry type
     def get_geometry_order(feature):
         geometry_type = feature["geometry"]["type"]
-        order = {
-            "Polygon": 1,
-            "MultiPolygon": 1,
-            "LineString": 2,
-            "MultiLineString": 2,
-            "Point": 3,
-            "MultiPoint": 3,
-        }
-        return order.get(geometry_type, float("inf"))  # Default to last if unknown type
+        # Default to last if unknown type
+        return GEOMETRY_ORDER.get(geometry_type, float("inf"))
 
     if combined_geojson:
         combined_geojson["features"] = sorted(
@@ -2067,6 +2856,7 @@ def process_geospatial_data(data):
         "properties": combined_properties,
         "image_urls": image_urls,
         "tooltip": tool_tip,
+        "layer_handles": layer_handles,
     }
 
 
@@ -2091,11 +2881,14 @@ def export_map_service(image, form_data):
 
         # Export shapefiles or raster datasets as images
         exported_images = [image_path]
-        fig, ax = plt.subplots(figsize=(10, 8))
         raster_data = None
 
-        for file_path in file_paths:
-            fig, ax = plt.subplots(figsize=(10, 8))  # Create a new figure for each file
+        file_paths = list(file_paths)
+        for i, file_path in enumerate(file_paths):
+            report_progress(i / len(file_paths), "Rendering map layers")
+            # Create a new figure for each file, not shared with other exports
+            fig = new_figure(figsize=(10, 8))
+            ax = fig.add_subplot()
 
             if file_path.endswith(".shp"):
                 gdf = gpd.read_file(file_path)
@@ -2110,8 +2903,8 @@ def export_map_service(image, form_data):
                 # Display raster
                 ax.imshow(raster_data, cmap=cmap, norm=norm, alpha=1)
                 # Add raster legend (Colorbar)
-                cbar = plt.colorbar(
-                    plt.cm.ScalarMappable(norm=norm, cmap=cmap),
+                cbar = fig.colorbar(
+                    cm.ScalarMappable(norm=norm, cmap=cmap),
                     ax=ax,
                     fraction=0.03,
                     pad=0.04,
@@ -2144,8 +2937,7 @@ def export_map_service(image, form_data):
             image_path = os.path.join(
                 export_dir, f"{output_filename}_{file_name}.{output_format}"
             )
-            plt.savefig(image_path, dpi=300, format=output_format)
-            plt.close(fig)
+            fig.savefig(image_path, dpi=300, format=output_format)
 
             exported_images.append(image_path)
 
@@ -1,5 +1,6 @@
 import os
 import signal
+from result_cache import clear_result_cache
 
 
 def shutdown_server():
@@ -8,3 +9,4 @@ def shutdown_server():
 
 def clear_cache(cache):
     cache.clear()
+    clear_result_cache()
@@ -118,6 +118,31 @@ def validate_get_data_args(request_args):
             "type": "string",
             "required": False,
         },
+        "format": {
+            "type": "string",
+            "required": False,
+            "allowed": ["records", "columnar"],
+        },
+        "result": {
+            "type": "string",
+            "required": False,
+            "allowed": ["data", "stats"],
+        },
+        "offset": {
+            "type": "string",
+            "required": False,
+            "regex": r"^\d*$",
+        },
+        "limit": {
+            "type": "string",
+            "required": False,
+            "regex": r"^\d*$",
+        },
+        "max_points": {
+            "type": "string",
+            "required": False,
+            "regex": r"^\d*$",
+        },
     }
     return validate_request_args(schema, request_args)
 
@@ -178,6 +203,8 @@ def validate_export_data_args(request_args):
                 "svg",
                 "pdf",
                 "shp",
+                "gpkg",
+                "fgb",
             ],
         },
         "export_path": {"type": "string", "required": True},
@@ -206,10 +233,19 @@ def validate_export_data_args(request_args):
             "required": False,
             "allowed": ["summer", "winter", "fall", "spring", ""],
         },
+        "report": {
+            "type": "string",
+            "required": False,
+            "allowed": ["per_id", ""],
+        },
         "geojson_data": {
             "type": "string",
             "required": False,
         },
+        "layer_handles": {
+            "type": "string",
+            "required": False,
+        },
         "feature": {
             "type": "string",
             "required": False,
@@ -281,6 +317,32 @@ def validate_export_map_args(image, form_data):
     return validate_request_args(schema, form_data)
 
 
+# Usage for /api/jobs endpoint, the export arguments are validated by their type
+def validate_job_args(request_args):
+    schema = {
+        "type": {
+            "type": "string",
+            "required": False,
+            "allowed": ["export_data", "export_map"],
+        },
+    }
+    return validate_request_args(schema, request_args)
+
+
+# Usage for /api/build_indexes endpoint
+def validate_build_indexes_args(request_args):
+    schema = {
+        "db_path": {"type": "string", "required": True, "regex": r"^.+\.db3$"},
+        "mode": {
+            "type": "string",
+            "required": False,
+            # In place indexes are only built with the indexer command line
+            "allowed": ["shadow"],
+        },
+    }
+    return validate_request_args(schema, request_args)
+
+
 def validate_serve_tif_args(filename):
     if filename and not os.path.exists(filename):
         return {"error": "Invalid path specified for the GeoTIFF file."}